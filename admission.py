@@ -0,0 +1,164 @@
+"""Admission control and fair scheduling of questions that call the model APIs
+
+Every question's embedding and chat calls run inside a slot from one
+process-wide FairScheduler, so only so many go out at once however many
+sessions ask. Waiting questions are served round-robin by session, so a
+session with several questions queued can't starve the others, and a
+question that can't be served within its deadline is turned away at once
+with a retry hint instead of piling onto a rate-limited API.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+
+from instrumentation import percentile, record_stage
+
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_MAX_QUEUED_PER_SESSION = 2
+DEFAULT_MAX_WAIT_SECONDS = 15.0
+# Assumed seconds per question until some have been timed
+INITIAL_SERVICE_SECONDS = 2.0
+
+
+class Busy(Exception):
+    """Raised instead of queueing a question that couldn't start in time"""
+
+    def __init__(self, retry_after, reason="busy"):
+        super().__init__(f"The assistant is {reason}; retry in {retry_after} s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class FairScheduler:
+    """Run at most max_concurrency jobs at once, queueing the rest fairly by session
+
+    A job is turned away (Busy) if the queue is full, its session already
+    has max_queued_per_session jobs waiting, or its estimated wait is past
+    its deadline; a queued job that isn't started by its deadline is turned
+    away then. shed counts every job turned away, expired the ones that had
+    queued first. Takes no locks; see the threading contract in async_runtime.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_queue=DEFAULT_MAX_QUEUE,
+                 max_queued_per_session=DEFAULT_MAX_QUEUED_PER_SESSION, max_wait=DEFAULT_MAX_WAIT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queued_per_session = max_queued_per_session
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.expired = 0
+        self.service_seconds = INITIAL_SERVICE_SECONDS
+        # Sessions with jobs waiting, in the order they are next served
+        self._queues = OrderedDict()
+        self._waits = deque(maxlen=1000)
+
+    def estimated_wait(self, position):
+        """Seconds until the job at this queue position (1 = next) is likely to start"""
+        return position * self.service_seconds / self.max_concurrency
+
+    def position(self, session):
+        """Where a new job from session would start in the round-robin order (1 = next)
+
+        Each other session gets a turn for each of this session's jobs
+        already waiting, plus one.
+        """
+        ahead = len(self._queues.get(session, ()))
+        others = sum(min(len(queue), ahead + 1) for name, queue in self._queues.items() if name != session)
+        return ahead + others + 1
+
+    async def run(self, session, work, deadline=None):
+        """Await work() once a slot is free; deadline is the longest wait in seconds
+
+        Raises Busy (with retry_after seconds) if the job can't start in time.
+        """
+        with record_stage("queue"):
+            await self._acquire(session, self.max_wait if deadline is None else deadline)
+        started = time.monotonic()
+        try:
+            return await work()
+        finally:
+            # Moving average of how long a job holds its slot
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * (time.monotonic() - started)
+            self._release()
+
+    def _busy(self, session, reason):
+        self.shed += 1
+        return Busy(max(1, math.ceil(self.estimated_wait(self.position(session)))), reason)
+
+    async def _acquire(self, session, deadline):
+        if self.active < self.max_concurrency and not self.waiting:
+            self.active += 1
+            self.admitted += 1
+            self._waits.append(0.0)
+            return
+
+        queue = self._queues.get(session)
+        if self.waiting >= self.max_queue:
+            raise self._busy(session, "busy")
+        if queue and len(queue) >= self.max_queued_per_session:
+            raise self._busy(session, "still working on your earlier questions")
+        if self.estimated_wait(self.position(session)) > deadline:
+            raise self._busy(session, "busy")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(session, deque()).append(waiter)
+        self.waiting += 1
+        enqueued = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, deadline)
+        except asyncio.TimeoutError:
+            self._forget(session, waiter)
+            self.expired += 1
+            raise self._busy(session, "busy")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Given a slot just as it was cancelled: pass it on
+                self._release()
+            else:
+                self._forget(session, waiter)
+            raise
+        self.admitted += 1
+        self._waits.append(time.monotonic() - enqueued)
+
+    def _forget(self, session, waiter):
+        queue = self._queues.get(session)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[session]
+
+    def _release(self):
+        """Hand the slot to the next waiting job, taking sessions in turn"""
+        while self._queues:
+            session, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self.waiting -= 1
+            if queue:
+                self._queues.move_to_end(session)
+            else:
+                del self._queues[session]
+            if not waiter.done():
+                # The slot passes straight to the waiter, so active is unchanged
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        waits = list(self._waits)
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "expired": self.expired,
+            "wait_p50": percentile(waits, 50),
+            "wait_p95": percentile(waits, 95),
+        }
@@ -0,0 +1,92 @@
+"""Semantic cache of answers to previously asked questions"""
+
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_MAX_ENTRIES = 256
+
+
+class AnswerCache:
+    """In-memory answer cache that matches questions by embedding similarity
+
+    Entries expire after ttl_seconds and are all dropped when the index
+    version changes, so answers never outlive the knowledge base they came from.
+    """
+
+    def __init__(self, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD,
+                 ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def set_index_version(self, version):
+        """Invalidate every entry if the knowledge base index has changed"""
+        with self._lock:
+            if version != self.index_version:
+                self._entries = []
+                self.index_version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        self._entries = [entry for entry in self._entries if entry["created"] >= cutoff]
+
+    def lookup(self, embedding):
+        """Return the cached response for the most similar past question, or None"""
+        query = _normalize(embedding)
+        with self._lock:
+            self._purge_expired()
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            matrix = np.stack([entry["embedding"] for entry in self._entries])
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry = self._entries[best]
+            return {
+                "answer": entry["answer"],
+                "source_documents": list(entry["source_documents"]),
+            }
+
+    def store(self, question, embedding, response):
+        """Remember the answer and sources of a chain response"""
+        with self._lock:
+            self._purge_expired()
+            self._entries.append({
+                "question": question,
+                "embedding": _normalize(embedding),
+                "answer": response.get("answer", ""),
+                "source_documents": list(response.get("source_documents", [])),
+                "created": time.time(),
+            })
+            # Drop the oldest entries once the cache is full
+            if len(self._entries) > self.max_entries:
+                self._entries = self._entries[-self.max_entries:]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,78 @@
+"""Shared asyncio event loop and pooled HTTP clients for the query path
+
+Streamlit runs every session's script in its own thread. Instead of each of
+those threads blocking on its own OpenAI round trips, questions are submitted
+as coroutines to one background event loop, where any number of them can wait
+on the network at once over a shared pool of keep-alive connections.
+
+Threading contract: coroutines on the loop only interleave at awaits, so
+process-wide helpers whose state is only touched from the loop (such as
+coalescing.SingleFlight, admission.FairScheduler and
+micro_batching.MicroBatcher) take no locks. They must not be called from
+other threads, nor from more than one event loop at a time.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+
+import httpx
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+
+
+class AsyncRuntime:
+    """Background event loop thread plus sync and async HTTP client pools"""
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive_connections=DEFAULT_MAX_KEEPALIVE_CONNECTIONS, timeout=60.0):
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.http_client = httpx.Client(limits=limits, timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="async-runtime", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """Schedule a coroutine on the loop and return a concurrent.futures.Future
+
+        The coroutine runs in a copy of the caller's context, so context
+        variables such as the active request trace carry over.
+        """
+        future = concurrent.futures.Future()
+
+        def start():
+            task = self.loop.create_task(coroutine)
+
+            def done(task):
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+
+            task.add_done_callback(done)
+
+        self.loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+        return future
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the loop and block the calling thread for its result"""
+        return self.submit(coroutine).result(timeout=timeout)
+
+    def close(self):
+        """Close the HTTP pools and stop the loop"""
+        self.http_client.close()
+        self.run(self.http_async_client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""Offline RAG benchmark: indexing throughput, retrieval and answer latency
+
+Runs the same indexing and chain code as the app against the deterministic
+fake backends in fake_backends.py, so no API key or credits are needed. The
+knowledge base is replicated synthetically to test larger corpora:
+
+    python benchmark.py --scales 1,10,100 --queries 50 --output benchmark_results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from chunk_metadata import ChunkMetadataIndex
+from chunking import DEFAULT_CHUNK_TOKENS
+from coalescing import SingleFlight, normalize_question
+from embedding_pipeline import EmbeddingPipeline
+from fake_backends import FakeChatModel, HashEmbeddings
+from indexing import (
+    INGEST_BATCH_SIZE,
+    KNOWLEDGE_BASE_DIRECTORY,
+    iter_knowledge_base,
+    list_knowledge_base,
+    make_text_splitter,
+    open_vectorstore,
+    sync_vectorstore,
+)
+from context_budget import count_tokens
+from instrumentation import percentile
+from lexical_index import LexicalIndex
+from micro_batching import DEFAULT_MAX_BATCH_SIZE, BatchedQueryEmbeddings
+from rag_chain import is_standalone_question, make_conversation_chain, make_retriever
+from reranking import DEFAULT_CANDIDATES
+from vector_backends import INDEX_TYPES, QUANTIZATIONS, VECTOR_BACKENDS
+
+QUESTIONS = [
+    "What is the ADDIE model?",
+    "What are best practices for eLearning design?",
+    "Explain constructivism in learning theory",
+    "How do adults learn differently?",
+    "What are Mayer's multimedia learning principles?",
+    "Explain the Zone of Proximal Development",
+    "How do I create scenario-based learning?",
+    "What is cognitive load theory?",
+]
+FOLLOW_UPS = [
+    "Can you give me an example?",
+    "How would I apply that in practice?",
+    "What are the common mistakes to avoid?",
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--knowledge-base", default=KNOWLEDGE_BASE_DIRECTORY,
+                        help="documents to replicate for the synthetic corpus")
+    parser.add_argument("--scales", default="1,10",
+                        help="comma-separated replication factors, e.g. 1,10,100,1000")
+    parser.add_argument("--queries", type=int, default=30,
+                        help="questions asked per scale, in conversations of two questions and a follow-up")
+    parser.add_argument("--embed-latency", type=float, default=0.0,
+                        help="simulated seconds per embedding request")
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="simulated seconds before the first generated token")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="simulated seconds between generated tokens")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes used to split documents")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_CHUNK_TOKENS,
+                        help="largest chunk in tokens")
+    parser.add_argument("--neighbor-chunks", type=int, default=1,
+                        help="section neighbours added per retrieved chunk while the budget has room")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--ingest-batch-size", type=int, default=INGEST_BATCH_SIZE,
+                        help="chunks buffered before they are embedded and committed")
+    parser.add_argument("--users", type=int, default=10,
+                        help="concurrent conversations for the async throughput test")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0,
+                        help="window for batching concurrent query embeddings and searches; "
+                             "the throughput test also runs without batching")
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument("--burst", type=int, default=30,
+                        help="users asking the same question at the same moment (coalescing test)")
+    parser.add_argument("--always-condense", action="store_true",
+                        help="condense every question with history, even standalone ones")
+    parser.add_argument("--backend", choices=VECTOR_BACKENDS, default="chroma")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="float16",
+                        help="vector encoding for the numpy backend")
+    parser.add_argument("--index", choices=INDEX_TYPES, default="flat",
+                        help="search structure for the numpy backend")
+    parser.add_argument("--k", type=int, default=3, help="chunks per answer")
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES,
+                        help="candidates re-ranked before the top k are kept; 0 disables re-ranking")
+    parser.add_argument("--mode", default="hybrid", help="retrieval mode: hybrid, vector or lexical")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="where to write machine-readable results")
+    return parser.parse_args(argv)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def replicate_corpus(source_directory, target_directory, scale):
+    """Copy every document scale times; chunk IDs include the path, so copies index separately"""
+    os.makedirs(target_directory, exist_ok=True)
+    names = sorted(name for name in os.listdir(source_directory) if name.endswith(".txt"))
+    for copy in range(scale):
+        for name in names:
+            stem = os.path.splitext(name)[0]
+            shutil.copyfile(
+                os.path.join(source_directory, name),
+                os.path.join(target_directory, f"{stem}_{copy:04d}.txt")
+            )
+
+
+def latency_summary(values):
+    return {f"p{pct}": percentile(values, pct) for pct in (50, 95, 99)}
+
+
+def history_for(question, chat_history, always_condense):
+    """History to send with a question, mirroring the app's condense fast path"""
+    if always_condense or not is_standalone_question(question, chat_history):
+        return chat_history
+    return []
+
+
+async def ask_concurrently(chain, users, questions_per_user, always_condense):
+    """Run users independent conversations at once on one event loop"""
+    async def conversation(user):
+        chat_history = []
+        for i in range(questions_per_user):
+            question = QUESTIONS[(user + i) % len(QUESTIONS)]
+            response = await chain.ainvoke({
+                "question": question,
+                "chat_history": history_for(question, chat_history, always_condense)
+            })
+            chat_history = chat_history + [(question, response["answer"])]
+
+    await asyncio.gather(*(conversation(user) for user in range(users)))
+
+
+async def ask_burst(chain, users, coalesce):
+    """Have users ask the same question at once, as when a class is told to; returns pipeline runs"""
+    flight = SingleFlight()
+    question = QUESTIONS[0]
+
+    async def ask(user):
+        if not coalesce:
+            return await chain.ainvoke({"question": question, "chat_history": []})
+        return await flight.run(
+            normalize_question(question),
+            lambda publish: chain.ainvoke({"question": question, "chat_history": []})
+        )
+
+    await asyncio.gather(*(ask(user) for user in range(users)))
+    return flight.leaders if coalesce else users
+
+
+def run_scale(args, scale, workdir):
+    knowledge_base = os.path.join(workdir, "knowledge_base")
+    persist_directory = os.path.join(workdir, "chroma_db")
+    replicate_corpus(args.knowledge_base, knowledge_base, scale)
+
+    # Query embeddings go through the batcher; indexing passes straight through
+    embeddings = BatchedQueryEmbeddings(
+        HashEmbeddings(latency=args.embed_latency), args.batch_window_ms / 1000, args.max_batch_size
+    )
+    pipeline = EmbeddingPipeline(
+        embeddings,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        requests_per_minute=1e9
+    )
+
+    # Indexing: stream, split, embed and write everything from scratch
+    started = time.perf_counter()
+    paths = list_knowledge_base(knowledge_base)
+    vectorstore = open_vectorstore(
+        embeddings,
+        persist_directory,
+        args.backend,
+        quantization=args.quantization,
+        index_type=args.index
+    )
+    lexical_index = LexicalIndex()
+    chunk_index = ChunkMetadataIndex()
+    stats = sync_vectorstore(
+        vectorstore,
+        iter_knowledge_base(paths),
+        make_text_splitter(args.chunk_tokens),
+        persist_directory,
+        workers=args.workers,
+        pipeline=pipeline,
+        lexical_index=lexical_index,
+        batch_size=args.ingest_batch_size,
+        chunk_index=chunk_index
+    )
+    index_seconds = time.perf_counter() - started
+
+    def build_chain(batch_window):
+        retriever = make_retriever(
+            vectorstore, lexical_index, k=args.k, mode=args.mode, candidates=args.candidates,
+            chunk_index=chunk_index, neighbor_chunks=args.neighbor_chunks,
+            batch_window=batch_window, max_batch_size=args.max_batch_size
+        )
+        chain = make_conversation_chain(
+            FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency, streaming=True),
+            FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency),
+            retriever
+        )
+        return retriever, chain
+
+    retriever, chain = build_chain(embeddings.batcher.window)
+
+    retrieval_latencies, answer_latencies, context_tokens = [], [], []
+    chat_history = []
+    for i in range(args.queries):
+        if i % 3 == 0:
+            # Start a new conversation
+            chat_history = []
+        if i % 3 == 2:
+            question = FOLLOW_UPS[i % len(FOLLOW_UPS)]
+        else:
+            question = QUESTIONS[i % len(QUESTIONS)]
+
+        started = time.perf_counter()
+        documents = retriever.invoke(question)
+        retrieval_latencies.append(time.perf_counter() - started)
+        context_tokens.append(sum(count_tokens(document.page_content) for document in documents))
+
+        started = time.perf_counter()
+        response = chain({
+            "question": question,
+            "chat_history": history_for(question, chat_history, args.always_condense)
+        })
+        answer_latencies.append(time.perf_counter() - started)
+        chat_history = chat_history + [(question, response["answer"])]
+
+    # Throughput with many users waiting on the (simulated) network at once,
+    # without and then with micro-batching of query embeddings and searches
+    questions_per_user = max(1, args.queries // args.users)
+    concurrent_seconds = {}
+    batch_window = embeddings.batcher.window
+    for batched in (False, True):
+        embeddings.batcher.window = batch_window if batched else 0.0
+        _, concurrent_chain = build_chain(embeddings.batcher.window)
+        before = embeddings.batcher.stats()
+        started = time.perf_counter()
+        asyncio.run(ask_concurrently(concurrent_chain, args.users, questions_per_user, args.always_condense))
+        concurrent_seconds[batched] = time.perf_counter() - started
+    after = embeddings.batcher.stats()
+    embedding_batches = after["batches"] - before["batches"]
+    query_embedding_batch_size = (after["items"] - before["items"]) / embedding_batches if embedding_batches else 0.0
+
+    # A burst of identical questions, each run separately and then coalesced
+    burst_seconds = {}
+    for coalesce in (False, True):
+        started = time.perf_counter()
+        burst_runs = asyncio.run(ask_burst(chain, args.burst, coalesce))
+        burst_seconds[coalesce] = time.perf_counter() - started
+
+    return {
+        "scale": scale,
+        "documents": len(paths),
+        "chunks": stats["chunks"],
+        "index_seconds": index_seconds,
+        "chunks_per_second": stats["chunks"] / index_seconds if index_seconds else 0.0,
+        "embedding_chunks_per_second": stats["chunks_per_second"],
+        "retrieval_seconds": latency_summary(retrieval_latencies),
+        "answer_seconds": latency_summary(answer_latencies),
+        "mean_context_tokens": sum(context_tokens) / len(context_tokens) if context_tokens else 0.0,
+        "concurrent_users": args.users,
+        "concurrent_questions_per_second": args.users * questions_per_user / concurrent_seconds[True],
+        "concurrent_questions_per_second_unbatched": args.users * questions_per_user / concurrent_seconds[False],
+        "query_embedding_batch_size": query_embedding_batch_size,
+        "burst_users": args.burst,
+        "burst_seconds_uncoalesced": burst_seconds[False],
+        "burst_seconds": burst_seconds[True],
+        "burst_pipeline_runs": burst_runs,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scales = [int(value) for value in args.scales.split(",") if value.strip()]
+
+    results = []
+    for scale in scales:
+        workdir = tempfile.mkdtemp(prefix=f"rag_bench_{scale}x_")
+        try:
+            print(f"Benchmarking {scale}x corpus...")
+            result = run_scale(args, scale, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        results.append(result)
+        print(
+            f"✓ {scale}x: {result['chunks']} chunks, {result['chunks_per_second']:.0f} chunks/sec indexed, "
+            f"retrieval p50 {result['retrieval_seconds']['p50'] * 1000:.1f}ms, "
+            f"answer p95 {result['answer_seconds']['p95'] * 1000:.1f}ms, "
+            f"{result['concurrent_questions_per_second']:.1f} questions/sec with {args.users} users "
+            f"({result['concurrent_questions_per_second_unbatched']:.1f} unbatched, "
+            f"{result['query_embedding_batch_size']:.1f} query embeddings per request), "
+            f"burst of {args.burst} in {result['burst_seconds'] * 1000:.0f}ms "
+            f"({result['burst_seconds_uncoalesced'] * 1000:.0f}ms uncoalesced), "
+            f"peak RSS {result['peak_rss_mb']:.0f} MB"
+        )
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Startup benchmark: cold start, first paint and rerun time of the Streamlit app
+
+Each sample starts a fresh Python process that runs learning_assistant.py
+headlessly through Streamlit's AppTest, the way a new server process serves
+its first visitor. It records how long the first script run takes to paint
+the landing page (including every import it triggers) and how long reruns
+take once the process is warm. Nothing on the landing page calls OpenAI.
+
+    python benchmark_startup.py --samples 5
+    python benchmark_startup.py --profile-imports --top 15
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "learning_assistant.py")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=3,
+                        help="fresh processes to start")
+    parser.add_argument("--reruns", type=int, default=5,
+                        help="reruns timed in each process after the first run")
+    parser.add_argument("--mode", choices=("build", "prebuilt"), default="build",
+                        help="INDEX_MODE for the app; prebuilt also opens the index on first run")
+    parser.add_argument("--profile-imports", action="store_true",
+                        help="also report the slowest top-level imports (python -X importtime)")
+    parser.add_argument("--top", type=int, default=10,
+                        help="imports listed by --profile-imports")
+    parser.add_argument("--output", default="startup_results.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def run_child(args):
+    """Time the app in this (fresh) process and print the timings as JSON"""
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    harness_seconds = time.perf_counter() - started
+
+    app = AppTest.from_file(APP_PATH, default_timeout=120)
+    started = time.perf_counter()
+    app.run()
+    first_run_seconds = time.perf_counter() - started
+
+    reruns = []
+    for _ in range(args.reruns):
+        started = time.perf_counter()
+        app.run()
+        reruns.append(time.perf_counter() - started)
+
+    print(json.dumps({
+        "harness_import_seconds": harness_seconds,
+        "first_run_seconds": first_run_seconds,
+        "rerun_seconds": reruns,
+        "exceptions": [str(exception.value) for exception in app.exception],
+        "modules_loaded": len(sys.modules),
+    }))
+    return 0
+
+
+def parse_importtime(stderr):
+    """Cumulative seconds per top-level import from python -X importtime output"""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented; their time is already in their parent's
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        name = name.strip()
+        totals[name] = totals.get(name, 0.0) + int(cumulative) / 1e6
+    return totals
+
+
+def run_sample(args, profile):
+    command = [sys.executable]
+    if profile:
+        command += ["-X", "importtime"]
+    command += [os.path.abspath(__file__), "--child", "--reruns", str(args.reruns)]
+    env = dict(os.environ, INDEX_MODE=args.mode)
+    # The landing page needs a key to get past the API key check; it's never used
+    env.setdefault("OPENAI_API_KEY", "sk-startup-benchmark")
+
+    started = time.perf_counter()
+    completed = subprocess.run(
+        command, cwd=os.path.dirname(APP_PATH), env=env, capture_output=True, text=True
+    )
+    process_seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup sample failed:\n{completed.stderr[-2000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_seconds"] = process_seconds
+    if profile:
+        result["imports"] = parse_importtime(completed.stderr)
+    return result
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        return run_child(args)
+
+    samples = []
+    for i in range(args.samples):
+        # Profiling adds overhead, so only the last sample is profiled
+        profile = args.profile_imports and i == args.samples - 1
+        sample = run_sample(args, profile)
+        if sample["exceptions"]:
+            print(f"❌ The app raised: {sample['exceptions']}")
+            return 1
+        samples.append(sample)
+        print(
+            f"✓ Sample {i + 1}: first run {sample['first_run_seconds'] * 1000:.0f}ms, "
+            f"rerun median {statistics.median(sample['rerun_seconds']) * 1000:.1f}ms, "
+            f"process {sample['process_seconds']:.2f}s, {sample['modules_loaded']} modules"
+        )
+
+    summary = {
+        "first_run_seconds": statistics.median(sample["first_run_seconds"] for sample in samples),
+        "rerun_seconds": statistics.median(
+            seconds for sample in samples for seconds in sample["rerun_seconds"]
+        ),
+        "process_seconds": statistics.median(sample["process_seconds"] for sample in samples),
+        "modules_loaded": samples[-1]["modules_loaded"],
+    }
+    print(
+        f"✅ Median first paint {summary['first_run_seconds'] * 1000:.0f}ms, "
+        f"rerun {summary['rerun_seconds'] * 1000:.1f}ms, process {summary['process_seconds']:.2f}s"
+    )
+
+    imports = samples[-1].get("imports")
+    if imports:
+        print(f"\nSlowest top-level imports (cumulative, {args.mode} mode):")
+        for name, seconds in sorted(imports.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+            print(f"  {seconds * 1000:8.1f}ms  {name}")
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "child")},
+        "summary": summary,
+        "samples": samples,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
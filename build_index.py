@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Build and validate the persisted knowledge base index offline
+
+Run this before deploying so the app can start with INDEX_MODE=prebuilt,
+which only opens chroma_db/ and never embeds documents:
+
+    python build_index.py
+    python build_index.py --validate-only
+    python build_index.py --name <knowledge base>
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from indexing import (
+    KNOWLEDGE_BASE_DIRECTORY,
+    INGEST_BATCH_SIZE,
+    PERSIST_DIRECTORY,
+    iter_knowledge_base,
+    list_knowledge_base,
+    make_text_splitter,
+    open_vectorstore,
+    sync_vectorstore,
+    validate_index,
+)
+from chunking import DEFAULT_CHUNK_TOKENS
+from embedding_cache import CACHE_PATH, CachedEmbeddings, EmbeddingCache
+from embedding_pipeline import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    EmbeddingPipeline,
+    EmbeddingPipelineError,
+)
+from knowledge_bases import INDEXES_DIRECTORY, KNOWLEDGE_BASES_DIRECTORY, discover_knowledge_bases
+from lexical_index import LexicalIndex
+from vector_backends import INDEX_TYPES, QUANTIZATIONS, VECTOR_BACKENDS
+from chunk_metadata import ChunkMetadataIndex
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--knowledge-base", default=KNOWLEDGE_BASE_DIRECTORY,
+                        help="folder of .txt documents to index")
+    parser.add_argument("--persist-directory", default=PERSIST_DIRECTORY,
+                        help="where the Chroma collection and manifest are written")
+    parser.add_argument("--name",
+                        help="named knowledge base to build (a folder under KNOWLEDGE_BASES_DIRECTORY, "
+                             "or default); sets --knowledge-base and --persist-directory")
+    parser.add_argument("--backend", choices=VECTOR_BACKENDS, default=os.getenv("VECTOR_BACKEND", "chroma"),
+                        help="vector store backend; use the same one as the app")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS,
+                        default=os.getenv("VECTOR_QUANTIZATION", "float16"),
+                        help="vector encoding for the numpy backend")
+    parser.add_argument("--index", choices=INDEX_TYPES, default=os.getenv("VECTOR_INDEX", "flat"),
+                        help="search structure for the numpy backend")
+    parser.add_argument("--embedding-cache", default=os.getenv("EMBEDDING_CACHE_PATH", CACHE_PATH),
+                        help="on-disk embedding cache shared with the app")
+    parser.add_argument("--chunk-tokens", type=int, default=int(os.getenv("CHUNK_TOKENS", DEFAULT_CHUNK_TOKENS)),
+                        help="largest chunk in tokens; use the same value as the app")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes used to split changed documents")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="chunks embedded and written per request")
+    parser.add_argument("--ingest-batch-size", type=int, default=INGEST_BATCH_SIZE,
+                        help="chunks buffered before they are embedded and committed; bounds memory")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="embedding requests in flight at once")
+    parser.add_argument("--requests-per-minute", type=float, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="embedding request budget; 429s back off further")
+    parser.add_argument("--validate-only", action="store_true",
+                        help="check the existing index without embedding anything")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+
+    if args.name:
+        knowledge_bases = discover_knowledge_bases(
+            directory=os.getenv("KNOWLEDGE_BASES_DIRECTORY", KNOWLEDGE_BASES_DIRECTORY),
+            indexes_directory=os.getenv("KNOWLEDGE_BASE_INDEXES", INDEXES_DIRECTORY)
+        )
+        if args.name not in knowledge_bases:
+            print(f"❌ Unknown knowledge base {args.name!r}; found: {', '.join(knowledge_bases)}")
+            return 1
+        args.knowledge_base = knowledge_bases[args.name].directory
+        args.persist_directory = knowledge_bases[args.name].persist_directory
+
+    from langchain_openai import OpenAIEmbeddings
+
+    embeddings = CachedEmbeddings(OpenAIEmbeddings(), EmbeddingCache(args.embedding_cache))
+    vectorstore = open_vectorstore(
+        embeddings,
+        args.persist_directory,
+        args.backend,
+        quantization=args.quantization,
+        index_type=args.index
+    )
+    lexical_index = LexicalIndex.load(args.persist_directory)
+    chunk_index = ChunkMetadataIndex.load(args.persist_directory)
+
+    if not args.validate_only:
+        paths = list_knowledge_base(args.knowledge_base)
+        if not paths:
+            print(f"❌ No documents found in {args.knowledge_base}")
+            return 1
+        print(f"✓ Found {len(paths)} document(s) in {args.knowledge_base}")
+
+        pipeline = EmbeddingPipeline(
+            embeddings,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            requests_per_minute=args.requests_per_minute
+        )
+        started = time.perf_counter()
+        try:
+            stats = sync_vectorstore(
+                vectorstore,
+                iter_knowledge_base(paths),
+                make_text_splitter(args.chunk_tokens),
+                args.persist_directory,
+                workers=args.workers,
+                pipeline=pipeline,
+                progress=lambda files_done, files_total, embedded: print(
+                    f"  {files_done}/{files_total} files, {embedded} chunks embedded"
+                ),
+                lexical_index=lexical_index,
+                chunk_index=chunk_index,
+                batch_size=args.ingest_batch_size,
+                total=len(paths)
+            )
+        except EmbeddingPipelineError as e:
+            print(f"❌ {e}")
+            print("Committed batches were saved; run again to resume")
+            return 1
+        elapsed = time.perf_counter() - started
+        print(
+            f"✓ Indexed {stats['chunks']} chunks in {elapsed:.1f}s "
+            f"({stats['added']} embedded, {stats['deleted']} removed, {stats['unchanged']} unchanged)"
+        )
+        if stats["added"]:
+            print(f"✓ Embedding throughput: {stats['chunks_per_second']:.1f} chunks/sec ({stats['retries']} retries)")
+
+    problems = validate_index(vectorstore, args.persist_directory, lexical_index, chunk_index)
+    if problems:
+        for problem in problems:
+            print(f"❌ {problem}")
+        return 1
+
+    print(f"✅ Index in {args.persist_directory} is valid")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""Per-chunk display metadata and section index computed once at index time
+
+Answers only keep chunk IDs; source names, offsets, sections and previews
+are looked up here when sources are rendered or exported. The section index
+(the parts of each section that was cut into several chunks) lets retrieval
+find a chunk's neighbours.
+"""
+
+import json
+import os
+import threading
+from functools import lru_cache
+
+from indexing import chunk_id
+
+CHUNK_METADATA_FILENAME = "chunk_metadata.json"
+PREVIEW_CHARACTERS = 200
+
+
+def make_preview(text, length=PREVIEW_CHARACTERS):
+    return text[:length] + "..." if len(text) > length else text
+
+
+def chunk_entry(document):
+    """Display metadata for one chunk"""
+    source = document.metadata.get("source", "Unknown")
+    start = document.metadata.get("start_index")
+    return {
+        "source": source,
+        "name": os.path.basename(source),
+        "start": start,
+        "end": start + len(document.page_content) if start is not None else None,
+        "preview": make_preview(document.page_content),
+        "section": document.metadata.get("section"),
+        "position": document.metadata.get("chunk"),
+        "part": document.metadata.get("section_part"),
+    }
+
+
+class ChunkMetadataIndex:
+    """Chunk ID -> source, character offsets, section and preview, persisted next to the vector store"""
+
+    def __init__(self):
+        self._entries = {}
+        self._sections = None
+        self._lock = threading.Lock()
+        self._render = lru_cache(maxsize=1024)(self._render_sources)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ids(self):
+        with self._lock:
+            return set(self._entries)
+
+    def get(self, cid):
+        return self._entries.get(cid)
+
+    def add(self, ids, documents):
+        """Record metadata for documents under the given chunk IDs"""
+        with self._lock:
+            for cid, document in zip(ids, documents):
+                self._entries[cid] = chunk_entry(document)
+            self._sections = None
+            self._render.cache_clear()
+
+    def remove(self, ids):
+        with self._lock:
+            for cid in ids:
+                self._entries.pop(cid, None)
+            self._sections = None
+            self._render.cache_clear()
+
+    def _section_index(self):
+        """(source, section) -> {position: chunk ID} for sections split into parts, rebuilt after changes"""
+        with self._lock:
+            if self._sections is None:
+                sections = {}
+                for cid, entry in self._entries.items():
+                    if entry.get("part") is not None and entry.get("position") is not None:
+                        sections.setdefault((entry["source"], entry["section"]), {})[entry["position"]] = cid
+                self._sections = sections
+            return self._sections
+
+    def neighbors(self, cid):
+        """(previous, next) parts of the section cid was cut from, None where there is none
+
+        Chunks holding whole sections have no neighbours.
+        """
+        entry = self._entries.get(cid)
+        if entry is None or entry.get("part") is None or entry.get("position") is None:
+            return None, None
+        positions = self._section_index().get((entry["source"], entry["section"]), {})
+        return positions.get(entry["position"] - 1), positions.get(entry["position"] + 1)
+
+    def references(self, documents):
+        """Chunk IDs of retrieved documents, recording any chunk not indexed yet"""
+        ids = [chunk_id(document.metadata.get("source", "unknown"), document.page_content) for document in documents]
+        missing = [(cid, document) for cid, document in zip(ids, documents) if cid not in self._entries]
+        if missing:
+            self.add([cid for cid, _ in missing], [document for _, document in missing])
+        return ids
+
+    def _render_sources(self, ids):
+        sources = []
+        for i, cid in enumerate(ids, 1):
+            entry = self._entries.get(cid)
+            if entry is None:
+                sources.append(f"**Source {i}:** *no longer in the knowledge base*")
+                continue
+            location = f" (characters {entry['start']}-{entry['end']})" if entry["start"] is not None else ""
+            section = f" · *{entry['section']}*" if entry.get("section") else ""
+            sources.append(f"**Source {i}: {entry['name']}**{section}{location}\n\n{entry['preview']}")
+        return "\n\n---\n\n".join(sources)
+
+    def render_sources(self, ids):
+        """Markdown for a list of chunk IDs; repeated renders are served from a cache"""
+        return self._render(tuple(ids))
+
+    def save(self, persist_directory):
+        """Atomically write the entries next to the vector store"""
+        with self._lock:
+            data = dict(self._entries)
+        os.makedirs(persist_directory, exist_ok=True)
+        path = os.path.join(persist_directory, CHUNK_METADATA_FILENAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, persist_directory):
+        """Load saved entries, or return an empty index if none exist"""
+        index = cls()
+        path = os.path.join(persist_directory, CHUNK_METADATA_FILENAME)
+        if not os.path.exists(path):
+            return index
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                index._entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+        return index
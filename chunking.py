@@ -0,0 +1,205 @@
+"""Structure-aware, token-sized splitting of knowledge base documents
+
+Documents are cut at headings first, then between paragraphs and lists, and
+only inside a paragraph or list when it is too long on its own. Chunks are
+sized in tokens and don't overlap: each one records its section (heading
+path) and position. When a section had to be cut into several chunks,
+retrieval pulls in the neighbouring part of a retrieved chunk while the
+context budget has room (see ChunkMetadataIndex.neighbors and
+context_budget.expand_with_neighbors), instead of every chunk storing a copy
+of the next one's start.
+"""
+
+import re
+
+from context_budget import DEFAULT_MODEL, count_tokens
+
+DEFAULT_CHUNK_TOKENS = 300
+SPLITTER_VERSION = 1
+# Heading paths are joined with this in chunk metadata
+SECTION_SEPARATOR = " > "
+
+MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+\S")
+NUMBERED_HEADING = re.compile(r"^\d+[.)]\s+\S")
+# Ways to cut an over-long block, coarsest first: lines, sentences, words
+BLOCK_SEPARATORS = (re.compile(r"\n"), re.compile(r"(?<=[.!?:;])\s+"), re.compile(r"\s+"))
+
+
+def heading_level(line):
+    """1 for a top-level heading, 2 for a numbered one, None if line isn't a heading
+
+    Headings are markdown "#" lines or short ALL-CAPS lines such as
+    "THE ADDIE MODEL" and "1. ANALYSIS PHASE".
+    """
+    line = line.strip()
+    match = MARKDOWN_HEADING.match(line)
+    if match:
+        return min(len(match.group(1)), 2)
+    if not line or len(line) > 100 or line.startswith(("-", "*", "•")):
+        return None
+    letters = [character for character in line if character.isalpha()]
+    if len(letters) < 3 or any(not character.isupper() for character in letters):
+        return None
+    return 2 if NUMBERED_HEADING.match(line) else 1
+
+
+def _spans(text, start, end, separator):
+    """Pieces of text[start:end] between separator matches, without surrounding whitespace"""
+    pieces, position = [], start
+    for match in separator.finditer(text, start, end):
+        pieces.append((position, match.start()))
+        position = match.end()
+    pieces.append((position, end))
+    return [span for span in (_strip(text, *piece) for piece in pieces) if span]
+
+
+def _strip(text, start, end):
+    """(start, end) narrowed to exclude surrounding whitespace, or None if nothing is left"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if start < end else None
+
+
+def parse_sections(text):
+    """Split text into sections of blocks
+
+    Returns a list of (heading path, [(start, end), ...]) where each block is
+    a heading line or a run of non-blank lines (a paragraph, or a list with
+    its lead-in line), as character offsets into text.
+    """
+    sections = []
+    path = []
+    blocks = []
+    block_start = None
+    position = 0
+
+    def close_block(end):
+        nonlocal block_start
+        if block_start is not None:
+            blocks.append(_strip(text, block_start, end))
+            block_start = None
+
+    for line in text.splitlines(keepends=True):
+        line_start, position = position, position + len(line)
+        level = heading_level(line)
+        if level is not None:
+            close_block(line_start)
+            # A heading right after another (e.g. a chapter and its first
+            # numbered section) joins it instead of starting an empty section
+            if blocks and any(heading_level(text[start:end]) is None for start, end in blocks):
+                sections.append((SECTION_SEPARATOR.join(path), blocks))
+                blocks = []
+            path = path[:level - 1] + [line.strip().lstrip("#").strip()]
+            blocks.append(_strip(text, line_start, position))
+        elif line.strip():
+            if block_start is None:
+                block_start = line_start
+        else:
+            close_block(line_start)
+    close_block(position)
+    if blocks:
+        sections.append((SECTION_SEPARATOR.join(path), blocks))
+    return sections
+
+
+class StructuredTextSplitter:
+    """Split documents along headings, paragraphs and lists into chunks of at most chunk_tokens
+
+    Sections that fit are kept whole, and consecutive small sections under
+    the same heading share a chunk. Chunks are exact slices of the document,
+    with start_index, section (the heading path), chunk (position in the
+    document) and, for parts of a section that didn't fit, section_part
+    added to their metadata. Instances are picklable, so
+    split_documents can run on a process pool (see indexing.sync_vectorstore).
+    """
+
+    def __init__(self, chunk_tokens=DEFAULT_CHUNK_TOKENS, model=DEFAULT_MODEL):
+        self.chunk_tokens = chunk_tokens
+        self.model = model
+
+    @property
+    def fingerprint(self):
+        """Changes whenever the same text would be split differently"""
+        return f"structured-v{SPLITTER_VERSION}:{self.chunk_tokens}:{self.model}"
+
+    def _pieces(self, text, start, end, level=0):
+        """(start, end, tokens) pieces of a block, cut finer until each fits chunk_tokens"""
+        tokens = count_tokens(text[start:end], self.model)
+        if tokens <= self.chunk_tokens or level == len(BLOCK_SEPARATORS):
+            return [(start, end, tokens)]
+        pieces = []
+        for piece_start, piece_end in _spans(text, start, end, BLOCK_SEPARATORS[level]):
+            pieces.extend(self._pieces(text, piece_start, piece_end, level + 1))
+        return pieces
+
+    def _pack(self, text, pieces):
+        """Greedily group consecutive pieces into (start, end) chunks of at most chunk_tokens"""
+        chunks, current, used = [], None, 0
+        for start, end, tokens in pieces:
+            if current is not None and used + tokens > self.chunk_tokens:
+                chunks.append(current)
+                current, used = None, 0
+            current = (start, end) if current is None else (current[0], end)
+            used += tokens
+        if current is not None:
+            chunks.append(current)
+        return chunks
+
+    def split_text_spans(self, text):
+        """(start, end, section, part) of every chunk of text, in document order
+
+        part numbers the chunks of a section too long for one chunk, and is
+        None for chunks holding whole sections.
+        """
+        chunks = []
+        group, group_tokens = [], 0
+
+        def flush():
+            nonlocal group, group_tokens
+            if group:
+                start, end = group[0][1][0][0], group[-1][1][-1][1]
+                chunks.append((start, end, _common_section([section for section, _ in group]), None))
+            group, group_tokens = [], 0
+
+        for section, blocks in parse_sections(text):
+            pieces = [piece for start, end in blocks for piece in self._pieces(text, start, end)]
+            tokens = sum(piece[2] for piece in pieces)
+            top = section.split(SECTION_SEPARATOR)[0]
+            if group and (group_tokens + tokens > self.chunk_tokens
+                          or group[0][0].split(SECTION_SEPARATOR)[0] != top):
+                flush()
+            if tokens > self.chunk_tokens:
+                # Too long for one chunk: split it on its own
+                for part, (start, end) in enumerate(self._pack(text, pieces)):
+                    chunks.append((start, end, section, part))
+                continue
+            group.append((section, blocks))
+            group_tokens += tokens
+        flush()
+        return chunks
+
+    def split_documents(self, documents):
+        from langchain_core.documents import Document
+
+        chunks = []
+        for document in documents:
+            text = document.page_content
+            for position, (start, end, section, part) in enumerate(self.split_text_spans(text)):
+                metadata = dict(document.metadata, start_index=start, section=section, chunk=position)
+                if part is not None:
+                    metadata["section_part"] = part
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
+
+
+def _common_section(sections):
+    """Longest heading path shared by every section"""
+    paths = [section.split(SECTION_SEPARATOR) for section in sections]
+    common = []
+    for parts in zip(*paths):
+        if any(part != parts[0] for part in parts):
+            break
+        common.append(parts[0])
+    return SECTION_SEPARATOR.join(common)
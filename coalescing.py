@@ -0,0 +1,89 @@
+"""Single-flight coalescing of identical questions asked at the same time
+
+When a class is told to ask the same thing at once, only the first question
+runs the pipeline; the others wait for its answer and see the same tokens
+stream in.
+"""
+
+import asyncio
+import re
+import unicodedata
+
+
+def normalize_question(question):
+    """Case-, spacing- and end-punctuation-insensitive form of a question"""
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?!.")
+
+
+class _Flight:
+    def __init__(self, future):
+        self.future = future
+        self.tokens = []
+        self.listeners = []
+
+
+class SingleFlight:
+    """Share one in-flight run among concurrent callers with the same key
+
+    Follows the threading contract in async_runtime. A key is forgotten as
+    soon as its run finishes, so nothing is cached: later callers start a new
+    run.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def run(self, key, work, on_token=None):
+        """Run work(publish) once per key at a time; returns (result, shared)
+
+        work is a coroutine function. It calls publish(token) for each
+        streamed token, and every caller's on_token receives it. Callers that
+        join late first get the tokens streamed so far. shared is True for
+        callers that waited on someone else's run. If the run fails, every
+        caller waiting on it gets the same exception.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            if on_token:
+                for token in flight.tokens:
+                    on_token(token)
+                flight.listeners.append(on_token)
+            return await asyncio.shield(flight.future), True
+
+        flight = _Flight(asyncio.get_running_loop().create_future())
+        # Don't warn about an exception nobody else was waiting for
+        flight.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        if on_token:
+            flight.listeners.append(on_token)
+        self._flights[key] = flight
+        self.leaders += 1
+
+        def publish(token):
+            flight.tokens.append(token)
+            for listener in list(flight.listeners):
+                listener(token)
+
+        try:
+            result = await work(publish)
+        except asyncio.CancelledError:
+            flight.future.cancel()
+            raise
+        except Exception as e:
+            flight.future.set_exception(e)
+            raise
+        else:
+            flight.future.set_result(result)
+            return result, False
+        finally:
+            self._flights.pop(key, None)
+
+    def stats(self):
+        return {"runs": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._flights)}
@@ -0,0 +1,122 @@
+"""Token budgets for retrieved context and conversation history"""
+
+import re
+from functools import lru_cache
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+SHINGLE_SIZE = 5
+WORD_PATTERN = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        # Unknown model or encodings not downloadable: fall back to an estimate
+        return None
+
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    """Count tokens with tiktoken, or estimate ~4 characters per token"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens, model=DEFAULT_MODEL):
+    """Cut text down to at most max_tokens tokens"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def _shingles(text):
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _containment(a, b):
+    """Share of the smaller shingle set that also appears in the other"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def select_documents(documents, max_tokens, k=None, model=DEFAULT_MODEL, overlap_threshold=0.5):
+    """Keep ranked documents that fit the token budget, skipping near-duplicates
+
+    A document is dropped if at least overlap_threshold of its word 5-grams
+    already appear in a kept document, which catches the overlap between
+    neighbouring chunks. Documents that don't fit are skipped so a smaller
+    one further down can still use the remaining budget.
+    """
+    kept, kept_shingles, used = [], [], 0
+    for document in documents:
+        if k is not None and len(kept) >= k:
+            break
+        shingles = _shingles(document.page_content)
+        if any(_containment(shingles, other) >= overlap_threshold for other in kept_shingles):
+            continue
+        tokens = count_tokens(document.page_content, model)
+        if used + tokens > max_tokens:
+            continue
+        kept.append(document)
+        kept_shingles.append(shingles)
+        used += tokens
+    return kept
+
+
+def expand_with_neighbors(documents, neighbors, max_tokens, per_document=1, model=DEFAULT_MODEL):
+    """Add neighbouring chunks of the selected documents while the token budget has room
+
+    neighbors(document) returns the (previous, next) chunks of a document's
+    section, either of which may be None. Documents are expanded in rank
+    order, the following chunk first since it usually continues the
+    passage; each neighbour is placed next to its document so the context
+    reads in document order. Chunks already selected aren't added twice.
+    """
+    used = sum(count_tokens(document.page_content, model) for document in documents)
+    included = {(document.metadata.get("source"), document.page_content) for document in documents}
+    expanded = []
+    for document in documents:
+        before, after = [], []
+        previous, following = neighbors(document) if per_document > 0 else (None, None)
+        for neighbor, side in ((following, after), (previous, before)):
+            if neighbor is None or len(before) + len(after) >= per_document:
+                continue
+            key = (neighbor.metadata.get("source"), neighbor.page_content)
+            tokens = count_tokens(neighbor.page_content, model)
+            if key in included or used + tokens > max_tokens:
+                continue
+            side.append(neighbor)
+            included.add(key)
+            used += tokens
+        expanded.extend(before + [document] + after)
+    return expanded
+
+
+def compact_history(chat_history, max_tokens, model=DEFAULT_MODEL):
+    """Window (question, answer) turns to the most recent ones that fit max_tokens
+
+    The latest turn is always kept; if it alone is over budget its answer is
+    truncated, since the condense step only needs the gist of it.
+    """
+    kept, used = [], 0
+    for question, answer in reversed(chat_history):
+        tokens = count_tokens(question, model) + count_tokens(answer, model)
+        if not kept and tokens > max_tokens:
+            answer = truncate_to_tokens(answer, max(0, max_tokens - count_tokens(question, model)), model)
+            tokens = max_tokens
+        elif used + tokens > max_tokens:
+            break
+        kept.append((question, answer))
+        used += tokens
+    kept.reverse()
+    return kept
@@ -0,0 +1,59 @@
+"""Conversation exports, built only when a download is requested"""
+
+import json
+from datetime import datetime
+
+SEPARATOR = "=" * 80
+
+
+class ConversationExporter:
+    """Render TXT/JSON exports of a conversation on demand
+
+    Messages only carry chunk IDs; source details come from the chunk metadata
+    index. Messages are rendered one at a time as they are read (e.g. from
+    ConversationStore.iter_messages), so nothing is kept between exports.
+    """
+
+    def __init__(self, chunk_index):
+        self.chunk_index = chunk_index
+
+    def _render_txt(self, number, message):
+        role = "You" if message["role"] == "user" else "Assistant"
+        lines = [f"Message {number} - {role}:", "-" * 40, message["content"]]
+        if message.get("source_ids"):
+            lines.append("\nSources:")
+            lines.append(self.chunk_index.render_sources(message["source_ids"]))
+        lines.append("\n" + SEPARATOR + "\n")
+        return "\n".join(lines)
+
+    def _render_json(self, message):
+        entry = {"role": message["role"], "content": message["content"]}
+        if message.get("source_ids"):
+            # "sources" keeps its rendered markdown; the chunk details go alongside
+            entry["sources"] = self.chunk_index.render_sources(message["source_ids"])
+            entry["source_chunks"] = [
+                self.chunk_index.get(cid) or {"chunk_id": cid} for cid in message["source_ids"]
+            ]
+        return json.dumps(entry, indent=2).replace("\n", "\n    ")
+
+    def to_txt(self, messages, total):
+        """Conversation as plain text"""
+        header = [
+            "AI Learning Assistant - Conversation Export",
+            f"Export Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            f"Total Messages: {total}",
+            SEPARATOR,
+            ""
+        ]
+        body = [self._render_txt(i, message) for i, message in enumerate(messages, 1)]
+        return "\n".join(header + body)
+
+    def to_json(self, messages, total):
+        """Conversation as JSON"""
+        body = [self._render_json(message) for message in messages]
+        return (
+            "{\n"
+            f'  "export_date": {json.dumps(datetime.now().isoformat())},\n'
+            f'  "total_messages": {total},\n'
+            '  "conversation": [\n    ' + ",\n    ".join(body) + "\n  ]\n}"
+        )
@@ -0,0 +1,98 @@
+"""Append-only SQLite store of conversation messages, kept outside session state
+
+Sessions only hold a conversation ID and how many messages they show; the
+messages themselves are read back a page at a time, so a long conversation
+costs neither rerun time nor server memory, and survives a restart.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+CONVERSATION_DB_PATH = "./conversations/conversations.sqlite3"
+DEFAULT_PAGE_SIZE = 20
+
+
+def new_conversation_id():
+    """Random, unguessable ID for a new conversation"""
+    return uuid.uuid4().hex
+
+
+def _message(turn, role, content, source_ids):
+    message = {"turn": turn, "role": role, "content": content}
+    if source_ids is not None:
+        message["source_ids"] = json.loads(source_ids)
+    return message
+
+
+class ConversationStore:
+    """Messages keyed by (conversation, turn), appended and read back in pages"""
+
+    def __init__(self, path=CONVERSATION_DB_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "conversation TEXT NOT NULL, turn INTEGER NOT NULL, role TEXT NOT NULL, "
+            "content TEXT NOT NULL, source_ids TEXT, created REAL NOT NULL, "
+            "PRIMARY KEY (conversation, turn))"
+        )
+        self._conn.commit()
+
+    def append(self, conversation, role, content, source_ids=None):
+        """Add a message to the end of a conversation; returns its turn number"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(turn) FROM messages WHERE conversation = ?", (conversation,)
+            ).fetchone()
+            turn = 0 if row[0] is None else row[0] + 1
+            self._conn.execute(
+                "INSERT INTO messages (conversation, turn, role, content, source_ids, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (conversation, turn, role, content,
+                 json.dumps(source_ids) if source_ids is not None else None, time.time())
+            )
+            self._conn.commit()
+        return turn
+
+    def count(self, conversation):
+        """Number of messages in a conversation"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(turn) FROM messages WHERE conversation = ?", (conversation,)
+            ).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def page(self, conversation, limit=DEFAULT_PAGE_SIZE, before=None):
+        """Up to limit messages before turn `before` (default: the latest ones), oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT turn, role, content, source_ids FROM messages "
+                "WHERE conversation = ? AND turn < ? ORDER BY turn DESC LIMIT ?",
+                (conversation, before if before is not None else 2 ** 62, limit)
+            ).fetchall()
+        return [_message(*row) for row in reversed(rows)]
+
+    def iter_messages(self, conversation, batch_size=500):
+        """Every message of a conversation in order, read batch_size at a time"""
+        turn = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT turn, role, content, source_ids FROM messages "
+                    "WHERE conversation = ? AND turn >= ? ORDER BY turn LIMIT ?",
+                    (conversation, turn, batch_size)
+                ).fetchall()
+            for row in rows:
+                yield _message(*row)
+            if len(rows) < batch_size:
+                return
+            turn = rows[-1][0] + 1
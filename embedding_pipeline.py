@@ -0,0 +1,193 @@
+"""Batched, concurrent embedding with rate limiting, retries and checkpoints"""
+
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_CONCURRENCY = 4
+DEFAULT_REQUESTS_PER_MINUTE = 500
+
+
+class EmbeddingPipelineError(Exception):
+    """Raised when a batch can't be embedded, after any retries"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, bursts up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Block until amount tokens are available, then take them"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_rate_limit_error(error):
+    """True for HTTP 429 / rate limit errors from the embeddings client"""
+    return (
+        _status_code(error) == 429
+        or type(error).__name__ == "RateLimitError"
+        or "rate limit" in str(error).lower()
+    )
+
+
+def is_retryable_error(error):
+    """Rate limits and server-side (5xx) failures are worth retrying"""
+    status = _status_code(error)
+    return is_rate_limit_error(error) or (status is not None and status >= 500)
+
+
+def _retry_after(error):
+    """Seconds the server asked us to wait, if it said"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def load_checkpoint(path):
+    """IDs already embedded and written by an interrupted run"""
+    if not path or not os.path.exists(path):
+        return set()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+
+def save_checkpoint(path, done_ids):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sorted(done_ids), f)
+    os.replace(tmp_path, path)
+
+
+def clear_checkpoint(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+class EmbeddingPipeline:
+    """Embed documents in concurrent batches under a requests-per-minute budget
+
+    Every request takes a token from a shared bucket. A 429 pauses all workers
+    (honouring Retry-After when present) with exponential backoff and jitter,
+    so the pipeline backs off as a whole instead of hammering the endpoint.
+    """
+
+    def __init__(self, embeddings, batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, max_retries=6,
+                 base_delay=1.0, max_delay=60.0):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(requests_per_minute / 60.0, capacity=self.concurrency)
+        self.retries = 0
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_for_backoff(self):
+        while True:
+            with self._lock:
+                wait = self._pause_until - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _embed_batch(self, texts):
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_backoff()
+            self.bucket.acquire()
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise EmbeddingPipelineError(f"Embedding request failed: {e}") from e
+                if attempt == self.max_retries:
+                    raise EmbeddingPipelineError(
+                        f"Embedding request still failing after {self.max_retries} retries: {e}"
+                    ) from e
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                with self._lock:
+                    self.retries += 1
+                    self._pause_until = max(self._pause_until, time.monotonic() + delay)
+
+    def run(self, ids, documents, write, checkpoint_path=None, progress=None):
+        """Embed documents and hand each finished batch to write(ids, documents, vectors)
+
+        IDs recorded in checkpoint_path by an interrupted run are skipped. The
+        checkpoint is updated after every write and removed once all batches
+        are done. Returns counts and throughput in chunks per second.
+        """
+        done = load_checkpoint(checkpoint_path)
+        pending = [(cid, document) for cid, document in zip(ids, documents) if cid not in done]
+        batches = [pending[start:start + self.batch_size] for start in range(0, len(pending), self.batch_size)]
+        skipped = len(ids) - len(pending)
+
+        started = time.perf_counter()
+        # self.retries counts over the pipeline's lifetime; report this run's
+        retries_before = self.retries
+        written = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as pool:
+            futures = {
+                pool.submit(self._embed_batch, [document.page_content for _, document in batch]): batch
+                for batch in batches
+            }
+            try:
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    vectors = future.result()
+                    batch_ids = [cid for cid, _ in batch]
+                    write(batch_ids, [document for _, document in batch], vectors)
+                    written += len(batch)
+                    if checkpoint_path:
+                        done.update(batch_ids)
+                        save_checkpoint(checkpoint_path, done)
+                    if progress:
+                        progress(written + skipped, len(ids))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        clear_checkpoint(checkpoint_path)
+        elapsed = time.perf_counter() - started
+        return {
+            "embedded": written,
+            "resumed": skipped,
+            "retries": self.retries - retries_before,
+            "seconds": elapsed,
+            "chunks_per_second": written / elapsed if elapsed > 0 else 0.0,
+        }
@@ -0,0 +1,131 @@
+"""Deterministic, offline stand-ins for the OpenAI embedding and chat models
+
+Used by benchmark.py to exercise the full indexing and question pipeline
+without network access or API spend. Both backends are hash-based, so the
+same input always gives the same output, and both can simulate latency.
+"""
+
+import asyncio
+import hashlib
+import math
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def _stable_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashEmbeddings(Embeddings):
+    """Feature-hashed bag-of-words vectors
+
+    Texts that share words get similar vectors, so retrieval behaves roughly
+    like a real (if weak) embedding model. latency is added per request and
+    per_text_latency per embedded text.
+    """
+
+    def __init__(self, size=256, latency=0.0, per_text_latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.model = f"hash-embeddings-{size}"
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        for word in WORD_PATTERN.findall(text.lower()):
+            value = _stable_hash(word)
+            vector[value % self.size] += 1.0 if (value >> 32) & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency + self.per_text_latency)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency + self.per_text_latency)
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers with words picked deterministically from its prompt
+
+    latency is the delay before the first token and token_latency the delay
+    between tokens. With streaming=True tokens are reported through the
+    usual on_llm_new_token callbacks.
+    """
+
+    model_name: str = "fake-chat"
+    latency: float = 0.0
+    token_latency: float = 0.0
+    response_words: int = 40
+    streaming: bool = False
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name}
+
+    def _words(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        vocabulary = WORD_PATTERN.findall(prompt) or ["answer"]
+        seed = _stable_hash(prompt)
+        return [vocabulary[(seed + i * 7919) % len(vocabulary)] for i in range(self.response_words)]
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        if self.streaming:
+            text = "".join(chunk.text for chunk in self._stream(messages, stop, run_manager, **kwargs))
+        else:
+            time.sleep(self.latency + self.token_latency * self.response_words)
+            text = " ".join(self._words(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        time.sleep(self.latency)
+        for i, word in enumerate(self._words(messages)):
+            if i:
+                time.sleep(self.token_latency)
+            token = word if i == 0 else " " + word
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        if self.streaming:
+            chunks = [chunk async for chunk in self._astream(messages, stop, run_manager, **kwargs)]
+            text = "".join(chunk.text for chunk in chunks)
+        else:
+            await asyncio.sleep(self.latency + self.token_latency * self.response_words)
+            text = " ".join(self._words(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        for i, word in enumerate(self._words(messages)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            token = word if i == 0 else " " + word
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
@@ -0,0 +1,117 @@
+"""Background hot reload of knowledge bases whose documents change on disk"""
+
+import os
+import threading
+import time
+
+from indexing import list_knowledge_base
+
+POLL_INTERVAL_SECONDS = 2.0
+
+
+def snapshot(directory):
+    """(modification time, size) of every document under directory, keyed by path"""
+    state = {}
+    for path in list_knowledge_base(directory):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        state[path] = (stat.st_mtime_ns, stat.st_size)
+    return state
+
+
+def diff_snapshots(old, new):
+    """Paths added, changed and deleted between two snapshots"""
+    return {
+        "added": sorted(path for path in new if path not in old),
+        "changed": sorted(path for path in new if path in old and new[path] != old[path]),
+        "deleted": sorted(path for path in old if path not in new),
+    }
+
+
+class KnowledgeBaseWatcher:
+    """Poll watched knowledge base folders and call on_change when their documents change
+
+    A change is only acted on once a folder looks the same on two polls in a
+    row, so a file that is still being copied isn't indexed half written.
+    on_change(knowledge_base, changes) runs on the watcher's thread, one
+    knowledge base at a time; if it raises, the change is retried on a later
+    poll.
+    """
+
+    def __init__(self, on_change, interval=POLL_INTERVAL_SECONDS):
+        self.on_change = on_change
+        self.interval = interval
+        self.reloads = 0
+        self.last_reload = None
+        self.last_error = None
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="knowledge-base-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def watch(self, knowledge_base):
+        """Start watching a knowledge base that was just indexed; repeated calls are no-ops"""
+        with self._lock:
+            if knowledge_base.name in self._watched:
+                return
+        indexed = snapshot(knowledge_base.directory)
+        with self._lock:
+            self._watched.setdefault(knowledge_base.name, {
+                "knowledge_base": knowledge_base,
+                "indexed": indexed,
+                "pending": None,
+            })
+
+    def poll(self):
+        """Check every watched folder once; returns the names that were reloaded"""
+        with self._lock:
+            entries = list(self._watched.values())
+        reloaded = []
+        for entry in entries:
+            current = snapshot(entry["knowledge_base"].directory)
+            if current == entry["indexed"]:
+                entry["pending"] = None
+                continue
+            if current != entry["pending"]:
+                # Wait for the folder to settle
+                entry["pending"] = current
+                continue
+
+            try:
+                self.on_change(entry["knowledge_base"], diff_snapshots(entry["indexed"], current))
+            except Exception as e:
+                self.last_error = f"{entry['knowledge_base'].name}: {e}"
+                entry["pending"] = None
+                continue
+            entry["indexed"] = current
+            entry["pending"] = None
+            self.reloads += 1
+            self.last_reload = time.time()
+            self.last_error = None
+            reloaded.append(entry["knowledge_base"].name)
+        return reloaded
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def stats(self):
+        with self._lock:
+            watched = list(self._watched)
+        return {
+            "watched": watched,
+            "reloads": self.reloads,
+            "last_reload": self.last_reload,
+            "last_error": self.last_error,
+        }
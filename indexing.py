@@ -0,0 +1,401 @@
+"""Incremental, content-hashed indexing of the knowledge base"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from embedding_pipeline import EmbeddingPipeline
+
+KNOWLEDGE_BASE_DIRECTORY = "knowledge_base/"
+PERSIST_DIRECTORY = "./chroma_db"
+MANIFEST_FILENAME = "index_manifest.json"
+MANIFEST_VERSION = 1
+CHECKPOINT_FILENAME = "embedding_checkpoint.json"
+# Chunks buffered before they are embedded, written and committed to the manifest
+INGEST_BATCH_SIZE = 512
+
+
+def hash_text(text):
+    """Return a stable SHA-256 hex digest for a piece of text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source, text):
+    """Build a content-addressed ID for a chunk of a source file"""
+    return hash_text(f"{source}\x00{text}")
+
+
+def list_knowledge_base(directory=KNOWLEDGE_BASE_DIRECTORY):
+    """Paths of every .txt document under the knowledge base directory, in sorted order"""
+    root = Path(directory)
+    return [
+        str(path) for path in sorted(root.glob("**/*.txt"))
+        if path.is_file() and not any(part.startswith(".") for part in path.relative_to(root).parts)
+    ]
+
+
+def iter_knowledge_base(paths):
+    """Yield documents one file at a time, so only the current file is held in memory"""
+    from langchain_community.document_loaders import TextLoader
+
+    for path in paths:
+        yield from TextLoader(path).load()
+
+
+def load_knowledge_base(directory=KNOWLEDGE_BASE_DIRECTORY):
+    """Load every .txt document under the knowledge base directory"""
+    return list(iter_knowledge_base(list_knowledge_base(directory)))
+
+
+def make_text_splitter(chunk_tokens=None):
+    """Text splitter shared by the app and the offline index build; see chunking"""
+    from chunking import DEFAULT_CHUNK_TOKENS, StructuredTextSplitter
+
+    return StructuredTextSplitter(chunk_tokens=chunk_tokens or DEFAULT_CHUNK_TOKENS)
+
+
+def open_vectorstore(embeddings, persist_directory=PERSIST_DIRECTORY, backend="chroma", **options):
+    """Open (or create) the persisted vector store; see vector_backends for backends and options"""
+    from vector_backends import open_vector_backend
+
+    return open_vector_backend(embeddings, persist_directory, backend, **options)
+
+
+def write_embeddings(vectorstore, ids, documents, vectors):
+    """Upsert already-computed vectors into the vector store"""
+    vectorstore.upsert_vectors(ids, documents, vectors)
+
+
+def index_version(files):
+    """Version string that changes whenever any indexed chunk changes"""
+    return hash_text("\n".join(sorted(cid for entry in files.values() for cid in entry["chunks"])))
+
+
+def load_manifest(persist_directory=PERSIST_DIRECTORY):
+    """Load the index manifest, or None if it is missing or unreadable"""
+    path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest, persist_directory=PERSIST_DIRECTORY):
+    """Atomically write the index manifest next to the vector store"""
+    os.makedirs(persist_directory, exist_ok=True)
+    path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _current_manifest(vectorstore, splitter, persist_directory):
+    """The manifest, or None if it's missing or describes another backend's store or way of chunking"""
+    manifest = load_manifest(persist_directory)
+    if manifest and (manifest.get("backend", "chroma") != vectorstore.name or manifest.get("splitter") != splitter):
+        return None
+    return manifest
+
+
+def can_sync_changes(vectorstore, text_splitter, persist_directory=PERSIST_DIRECTORY):
+    """Whether sync_vectorstore can be given only the changed files (see its removed argument)"""
+    manifest = _current_manifest(vectorstore, getattr(text_splitter, "fingerprint", None), persist_directory)
+    return bool(manifest) and manifest.get("complete", True)
+
+
+def delete_stale_vectors(vectorstore, persist_directory=PERSIST_DIRECTORY):
+    """Delete the vectors a sync with defer_deletes left in the store; returns how many"""
+    manifest = load_manifest(persist_directory)
+    stale = manifest.pop("stale", None) if manifest else None
+    if not stale:
+        return 0
+    vectorstore.delete(ids=stale)
+    vectorstore.save()
+    save_manifest(manifest, persist_directory)
+    return len(stale)
+
+
+class _SideIndex:
+    """A chunk-keyed index kept in step with the vector store (BM25, chunk metadata)"""
+
+    def __init__(self, index):
+        self.index = index
+        self.ids = index.ids()
+        self.pending = {}
+
+    def want(self, cid, chunk, refresh=False):
+        # A changed file refreshes its unchanged chunks too, since their
+        # offsets and positions may have moved
+        if refresh or cid not in self.ids:
+            self.pending[cid] = chunk
+
+    def is_missing_any(self, ids):
+        return not self.ids.issuperset(ids)
+
+    def flush(self):
+        if self.pending:
+            self.index.add(list(self.pending), list(self.pending.values()))
+            self.ids.update(self.pending)
+            self.pending.clear()
+
+    def remove(self, ids):
+        self.index.remove(ids)
+        self.ids.difference_update(ids)
+
+
+def sync_vectorstore(vectorstore, documents, text_splitter, persist_directory=PERSIST_DIRECTORY,
+                     workers=1, pipeline=None, progress=None, lexical_index=None,
+                     batch_size=INGEST_BATCH_SIZE, total=None, chunk_index=None, removed=None,
+                     defer_deletes=False):
+    """Bring the persisted collection in line with documents, embedding only new chunks
+
+    documents can be any iterable (e.g. iter_knowledge_base()) and is consumed
+    one file at a time. Files whose content hash matches the manifest are
+    skipped; changed files are split and their new chunks buffered. Every
+    batch_size chunks the buffer goes through an EmbeddingPipeline (a default
+    one if none is given), is upserted and its files are committed to the
+    manifest, so peak memory depends on batch_size rather than corpus size and
+    an interrupted sync keeps everything committed so far. Stores without
+    durable_writes (the numpy backend) are only saved once, at the end; an
+    interrupted sync of one starts over, with vectors from the embedding
+    cache. Vectors for chunks (or whole files) that disappeared are deleted.
+    A lexical_index and a chunk_index (ChunkMetadataIndex), if given, are
+    kept in step with the same chunks and saved next to the manifest.
+
+    If removed (a list of sources) is given, documents only holds new and
+    changed files: other files in the manifest are kept without being read,
+    except the removed ones. That needs a current manifest (see
+    can_sync_changes). With defer_deletes, vectors of chunks that are gone
+    stay in the store, listed in the manifest, until delete_stale_vectors()
+    is called once nothing can still be searching for them; the side indexes
+    drop them straight away.
+
+    Changed files are split on a pool of workers processes once a batch
+    holds more than one of them. If text_splitter has a fingerprint (see
+    chunking.StructuredTextSplitter) it is recorded in the manifest, and a
+    different one re-splits every file.
+
+    progress(files_done, files_total, chunks_embedded) is called as work
+    completes; files_total is total, len(documents), or None if neither is known.
+    """
+    splitter = getattr(text_splitter, "fingerprint", None)
+    # Without a manifest for this backend and way of chunking, index from
+    # scratch (vectors come back from the embedding cache)
+    manifest = _current_manifest(vectorstore, splitter, persist_directory)
+    old_files = manifest["files"] if manifest else {}
+    files = dict(old_files)
+    if total is None and hasattr(documents, "__len__"):
+        total = len(documents)
+    if pipeline is None:
+        pipeline = EmbeddingPipeline(vectorstore.embeddings)
+    checkpoint_path = os.path.join(persist_directory, CHECKPOINT_FILENAME)
+
+    # Without a complete manifest we can't trust the collection: reuse vectors
+    # already stored under the right ID and drop anything else at the end
+    # (e.g. vectors from an old full rebuild)
+    reconcile = manifest is None or not manifest.get("complete", True)
+    if removed is not None and reconcile:
+        raise ValueError("Syncing only changed files needs a complete index manifest")
+    existing = vectorstore.stored_ids() if reconcile else set()
+    side_indexes = [_SideIndex(index) for index in (lexical_index, chunk_index) if index is not None]
+
+    seen_sources = set()
+    to_split = []
+    pending_files = {}
+    embed_ids, embed_documents = [], []
+    deferred = set(manifest.get("stale", ())) if manifest else set()
+    counts = {"files": 0, "added": 0, "deleted": 0, "unchanged": 0, "retries": 0, "seconds": 0.0}
+
+    def report(embedding=0):
+        if progress:
+            progress(counts["files"], total, counts["added"] + embedding)
+
+    def delete(ids):
+        if not ids:
+            return
+        if defer_deletes:
+            deferred.update(ids)
+        else:
+            vectorstore.delete(ids=list(ids))
+        for side in side_indexes:
+            side.remove(ids)
+        counts["deleted"] += len(ids)
+
+    def commit():
+        """Embed and write the buffered chunks, then record their files in the manifest"""
+        if embed_ids:
+            result = pipeline.run(
+                embed_ids,
+                embed_documents,
+                lambda ids, docs, vectors: write_embeddings(vectorstore, ids, docs, vectors),
+                # Per-batch checkpoints only help if each write is durable
+                checkpoint_path=checkpoint_path if vectorstore.durable_writes else None,
+                progress=lambda done, _: report(done)
+            )
+            counts["added"] += len(embed_ids)
+            counts["retries"] += result["retries"]
+            counts["seconds"] += result["seconds"]
+        for side in side_indexes:
+            side.flush()
+
+        # Chunks a changed file no longer has
+        stale = set()
+        for source, entry in pending_files.items():
+            previous = old_files.get(source)
+            if previous:
+                stale.update(set(previous["chunks"]) - set(entry["chunks"]))
+            files[source] = entry
+        delete(stale)
+
+        if vectorstore.durable_writes and (embed_ids or stale or pending_files):
+            # Record progress so an interrupted sync resumes from here. A store
+            # whose writes only last once saved is saved (and its IVF lists
+            # built) once at the end instead of being rewritten per commit.
+            save_manifest(
+                {"version": MANIFEST_VERSION, "backend": vectorstore.name, "splitter": splitter,
+                 "index_version": index_version(files), "files": files, "complete": False},
+                persist_directory
+            )
+        embed_ids.clear()
+        embed_documents.clear()
+        pending_files.clear()
+        report()
+
+    pool = None
+
+    def split_pending():
+        nonlocal pool
+        batch = [document for document, _, _ in to_split]
+        if workers > 1 and len(batch) > 1 and pool is None:
+            # Started on demand, so a sync of one changed file stays in-process
+            pool = ProcessPoolExecutor(max_workers=workers)
+        if pool is None:
+            chunk_lists = [text_splitter.split_documents([document]) for document in batch]
+        else:
+            chunk_lists = pool.map(text_splitter.split_documents, [[document] for document in batch])
+        for (_, source, file_hash), chunks in zip(to_split, chunk_lists):
+            previous = old_files.get(source)
+            old_ids = set(previous["chunks"]) if previous else set()
+            ids, seen = [], set()
+            for chunk in chunks:
+                cid = chunk_id(source, chunk.page_content)
+                if cid in seen:
+                    continue
+                seen.add(cid)
+                ids.append(cid)
+                if cid in old_ids or cid in existing:
+                    counts["unchanged"] += 1
+                else:
+                    embed_ids.append(cid)
+                    embed_documents.append(chunk)
+                for side in side_indexes:
+                    side.want(cid, chunk, refresh=True)
+            pending_files[source] = {"hash": file_hash, "chunks": ids}
+            counts["files"] += 1
+        to_split.clear()
+        report()
+
+    try:
+        for document in documents:
+            source = document.metadata.get("source", "unknown")
+            file_hash = hash_text(document.page_content)
+            seen_sources.add(source)
+            previous = old_files.get(source)
+            if previous and previous["hash"] == file_hash:
+                # Unchanged files keep their chunks; only re-split one if a
+                # side index is missing some of them
+                counts["unchanged"] += len(previous["chunks"])
+                counts["files"] += 1
+                if any(side.is_missing_any(previous["chunks"]) for side in side_indexes):
+                    for chunk in text_splitter.split_documents([document]):
+                        cid = chunk_id(source, chunk.page_content)
+                        for side in side_indexes:
+                            side.want(cid, chunk)
+                report()
+            else:
+                to_split.append((document, source, file_hash))
+                if len(to_split) >= max(workers, 1) * 4:
+                    split_pending()
+            if len(embed_ids) >= batch_size or any(len(side.pending) >= batch_size for side in side_indexes):
+                commit()
+        if to_split:
+            split_pending()
+        commit()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # Files that were removed from the knowledge base
+    if removed is None:
+        gone = [source for source in files if source not in seen_sources]
+    else:
+        gone = [source for source in removed if source in files and source not in seen_sources]
+    stale = set()
+    for source in gone:
+        stale.update(files.pop(source)["chunks"])
+    wanted = {cid for entry in files.values() for cid in entry["chunks"]}
+    if reconcile:
+        stale.update(existing - wanted)
+    delete(stale)
+    # Left behind by an earlier deferred sync
+    deferred -= wanted
+    if deferred and not defer_deletes:
+        vectorstore.delete(ids=list(deferred))
+        deferred.clear()
+
+    for side in side_indexes:
+        side.remove(side.ids - wanted)
+        side.index.save(persist_directory)
+
+    vectorstore.save()
+    version = index_version(files)
+    manifest = {"version": MANIFEST_VERSION, "backend": vectorstore.name, "splitter": splitter,
+                "index_version": version, "files": files, "complete": True}
+    if deferred:
+        manifest["stale"] = sorted(deferred)
+    save_manifest(manifest, persist_directory)
+
+    return {
+        "added": counts["added"],
+        "deleted": counts["deleted"],
+        "unchanged": counts["unchanged"],
+        "chunks": len(wanted),
+        "index_version": version,
+        "chunks_per_second": counts["added"] / counts["seconds"] if counts["seconds"] else 0.0,
+        "retries": counts["retries"],
+    }
+
+
+def validate_index(vectorstore, persist_directory=PERSIST_DIRECTORY, lexical_index=None, chunk_index=None):
+    """Check the persisted collection against its manifest; returns a list of problems"""
+    manifest = load_manifest(persist_directory)
+    if manifest is None:
+        return [f"No index manifest found in {persist_directory}"]
+    if not manifest.get("complete", True):
+        return ["The last index build did not finish; run it again to resume"]
+
+    expected = {cid for entry in manifest["files"].values() for cid in entry["chunks"]}
+    stored = vectorstore.stored_ids()
+    problems = []
+    if not expected:
+        problems.append("Index manifest lists no chunks")
+    missing = expected - stored
+    if missing:
+        problems.append(f"{len(missing)} chunk(s) in the manifest are missing from the vector store")
+    extra = stored - expected - set(manifest.get("stale", ()))
+    if extra:
+        problems.append(f"{len(extra)} vector(s) in the store are not in the manifest")
+    if lexical_index is not None and lexical_index.ids() != expected:
+        problems.append("Lexical index does not match the manifest")
+    if chunk_index is not None and chunk_index.ids() != expected:
+        problems.append("Chunk metadata index does not match the manifest")
+    return problems
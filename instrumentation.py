@@ -0,0 +1,284 @@
+"""Per-question latency, token and cost instrumentation for the RAG pipeline"""
+
+import json
+import math
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+from context_budget import count_tokens
+
+STAGES = ("queue", "condense", "embed_query", "retrieve", "generate")
+
+# USD per 1K tokens as (input, output)
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.005, 0.015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "text-embedding-ada-002": (0.0001, 0.0),
+    "text-embedding-3-small": (0.00002, 0.0),
+    "text-embedding-3-large": (0.00013, 0.0),
+}
+
+_current_trace = ContextVar("current_trace", default=None)
+
+
+def estimate_cost(model, input_tokens, output_tokens):
+    """Estimated USD cost of a call; unknown models cost 0"""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1000
+
+
+class RequestTrace:
+    """Timings, token counts and cost of answering one question"""
+
+    def __init__(self, question):
+        self.question = question
+        self.timestamp = datetime.now().isoformat()
+        self.started = time.perf_counter()
+        self.total_seconds = None
+        self.cached = False
+        # Answered by another session's identical question that was in flight
+        self.coalesced = False
+        self.error = None
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.tokens = {name: {"input": 0, "output": 0} for name in STAGES}
+        self.cost = 0.0
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] += seconds
+
+    def add_tokens(self, name, model, input_tokens, output_tokens):
+        with self._lock:
+            self.tokens[name]["input"] += input_tokens
+            self.tokens[name]["output"] += output_tokens
+            self.cost += estimate_cost(model, input_tokens, output_tokens)
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self.started
+
+    def to_dict(self):
+        return {
+            "timestamp": self.timestamp,
+            "question": self.question,
+            "cached": self.cached,
+            "coalesced": self.coalesced,
+            "error": self.error,
+            "total_seconds": self.total_seconds,
+            "stages": self.stages,
+            "tokens": self.tokens,
+            "cost_usd": self.cost,
+        }
+
+
+@contextmanager
+def record_stage(name):
+    """Time a block and add it to the active trace, if there is one"""
+    trace = _current_trace.get()
+    started = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        if trace is not None:
+            trace.add_stage(name, time.perf_counter() - started)
+
+
+class TimedEmbeddings(Embeddings):
+    """Embeddings wrapper that attributes query embedding calls to the active trace
+
+    Wrap the network client (inside any cache) so only real calls are timed
+    and charged.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with record_stage("embed_query") as trace:
+            vector = self.embeddings.embed_query(text)
+        if trace is not None:
+            trace.add_tokens("embed_query", self.model, count_tokens(text), 0)
+        return vector
+
+    async def aembed_query(self, text):
+        with record_stage("embed_query") as trace:
+            vector = await self.embeddings.aembed_query(text)
+        if trace is not None:
+            trace.add_tokens("embed_query", self.model, count_tokens(text), 0)
+        return vector
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """Collect answer tokens as they stream in, for another thread to render
+
+    Tokens arrive on whatever thread runs the chain; drain() folds the ones
+    received so far into text from the thread that displays them.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self.text = ""
+        self.tokens = queue.Queue()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.put(token)
+
+    def drain(self):
+        """Append queued tokens to text; returns whether any arrived"""
+        received = False
+        while not self.tokens.empty():
+            self.text += self.tokens.get_nowait()
+            received = True
+        return received
+
+
+class TokenCallbackHandler(BaseCallbackHandler):
+    """Pass each streamed token to a function, e.g. to share it with other sessions"""
+
+    run_inline = True
+
+    def __init__(self, on_token):
+        self.on_token = on_token
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.on_token(token)
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """Attribute chat model and retriever events of a chain run to RAG stages
+
+    Chat model calls before retrieval are question condensation; calls after
+    it are answer generation.
+    """
+
+    # Only bookkeeping, so it runs on the event loop rather than in an executor
+    run_inline = True
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._retrieved = False
+        self._retriever_run = None
+        self._retriever_started = None
+        self._llm_runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or "unknown"
+        text = "\n".join(str(message.content) for batch in messages for message in batch)
+        self._llm_runs[run_id] = {
+            "stage": "generate" if self._retrieved else "condense",
+            "model": model,
+            "started": time.perf_counter(),
+            "input_tokens": count_tokens(text),
+        }
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        self.trace.add_stage(run["stage"], time.perf_counter() - run["started"])
+
+        # Streaming responses carry no usage, so count the generated text
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        input_tokens = usage.get("prompt_tokens", run["input_tokens"])
+        output_tokens = usage.get("completion_tokens")
+        if output_tokens is None:
+            output_tokens = sum(
+                count_tokens(generation.text) for generations in response.generations for generation in generations
+            )
+        self.trace.add_tokens(run["stage"], run["model"], input_tokens, output_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._llm_runs.pop(run_id, None)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        # Retrievers can be nested; only time the outermost one
+        if self._retriever_run is None:
+            self._retriever_run = run_id
+            self._retriever_started = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        if run_id == self._retriever_run:
+            self.trace.add_stage("retrieve", time.perf_counter() - self._retriever_started)
+            self._retriever_run = None
+            self._retrieved = True
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        if run_id == self._retriever_run:
+            self._retriever_run = None
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class MetricsRecorder:
+    """Process-wide store of recent request traces with percentile summaries"""
+
+    def __init__(self, max_traces=1000):
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, question):
+        """Make a new trace active for the block and record it when the block exits"""
+        trace = RequestTrace(question)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except Exception as e:
+            trace.error = str(e)
+            raise
+        finally:
+            _current_trace.reset(token)
+            trace.finish()
+            with self._lock:
+                self._traces.append(trace)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._traces)
+
+    def summary(self):
+        """p50/p95/p99 seconds for the whole request and each stage, plus mean cost"""
+        with self._lock:
+            traces = list(self._traces)
+        if not traces:
+            return {}
+        series = {"total": [t.total_seconds for t in traces]}
+        for name in STAGES:
+            series[name] = [t.stages[name] for t in traces if not t.cached]
+        summary = {
+            name: {f"p{pct}": percentile(values, pct) for pct in (50, 95, 99)}
+            for name, values in series.items()
+        }
+        summary["requests"] = len(traces)
+        summary["mean_cost_usd"] = sum(t.cost for t in traces) / len(traces)
+        return summary
+
+    def export_jsonl(self):
+        """All recorded traces as JSON lines"""
+        with self._lock:
+            traces = list(self._traces)
+        return "\n".join(json.dumps(trace.to_dict()) for trace in traces) + "\n"
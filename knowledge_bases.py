@@ -0,0 +1,249 @@
+"""Named knowledge bases and the shared, memory-capped cache of loaded collections
+
+Each knowledge base is a folder of .txt documents with its own persisted
+index. knowledge_base/ is the "default" one; every folder under
+knowledge_bases/ is another, indexed into indexes/<name>/. Collections are
+opened on first use, shared by every session and evicted least recently used
+first once their estimated size passes the memory limit.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from indexing import KNOWLEDGE_BASE_DIRECTORY, PERSIST_DIRECTORY
+
+KNOWLEDGE_BASES_DIRECTORY = "knowledge_bases/"
+INDEXES_DIRECTORY = "./indexes"
+DEFAULT_KNOWLEDGE_BASE = "default"
+DEFAULT_MEMORY_LIMIT_MB = 1024
+
+
+class KnowledgeBase:
+    """A named folder of documents and the directory its index is persisted to"""
+
+    def __init__(self, name, directory, persist_directory):
+        self.name = name
+        self.directory = directory
+        self.persist_directory = persist_directory
+
+    def __repr__(self):
+        return f"KnowledgeBase({self.name!r}, {self.directory!r}, {self.persist_directory!r})"
+
+
+def discover_knowledge_bases(default_directory=KNOWLEDGE_BASE_DIRECTORY, default_persist_directory=PERSIST_DIRECTORY,
+                             directory=KNOWLEDGE_BASES_DIRECTORY, indexes_directory=INDEXES_DIRECTORY):
+    """Knowledge bases by name: default_directory as "default", then each folder under directory
+
+    "default" is always listed when there are no other knowledge bases, so a
+    missing knowledge_base/ folder is still reported where the app expects it.
+    """
+    named = {}
+    if os.path.isdir(directory):
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if entry.is_dir() and not entry.name.startswith("."):
+                named[entry.name] = KnowledgeBase(
+                    entry.name, entry.path, os.path.join(indexes_directory, entry.name)
+                )
+
+    bases = {}
+    if os.path.isdir(default_directory) or not named:
+        bases[DEFAULT_KNOWLEDGE_BASE] = KnowledgeBase(
+            DEFAULT_KNOWLEDGE_BASE, default_directory, default_persist_directory
+        )
+    for name, knowledge_base in named.items():
+        bases.setdefault(name, knowledge_base)
+    return bases
+
+
+def directory_size(path):
+    """Total size in bytes of the files under path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Collection:
+    """One knowledge base's loaded index: vector store, side indexes, answer cache and chain
+
+    memory_bytes is estimated from the size of the persisted index, which
+    tracks the vectors, chunk texts and BM25 data held once it's open.
+    """
+
+    def __init__(self, knowledge_base, vectorstore, lexical_index, chunk_index, answer_cache):
+        self.knowledge_base = knowledge_base
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.chunk_index = chunk_index
+        self.answer_cache = answer_cache
+        self.chain = None
+        self.memory_bytes = 0
+        self.in_use = 0
+        # Set once the cache has dropped it; it's closed when no question uses it
+        self.retired = False
+        # The collection this one was rebuilt from, sharing its vector store
+        self.predecessor = None
+
+    @property
+    def name(self):
+        return self.knowledge_base.name
+
+    def busy(self):
+        """Whether a question is using this collection or the one it replaced"""
+        return bool(self.in_use or (self.predecessor is not None and self.predecessor.in_use))
+
+    def close(self):
+        self.vectorstore.close()
+
+
+class CollectionCache:
+    """Loaded collections shared by every session, evicting idle ones over a memory limit
+
+    A collection is loaded at most once at a time, however many sessions ask
+    for it together. Collections checked out to answer a question are never
+    closed under it; if every other collection is busy the limit is briefly
+    exceeded instead.
+    """
+
+    def __init__(self, memory_limit_bytes=DEFAULT_MEMORY_LIMIT_MB * 1024 * 1024):
+        self.memory_limit_bytes = memory_limit_bytes
+        self.evictions = 0
+        self._collections = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._collections)
+
+    def get(self, name):
+        """The loaded collection called name, or None; marks it recently used"""
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is not None:
+                self._collections.move_to_end(name)
+            return collection
+
+    def lock(self, name):
+        """Lock held while the collection called name is loaded or rebuilt"""
+        with self._lock:
+            return self._loading.setdefault(name, threading.RLock())
+
+    def load(self, name, loader):
+        """The collection called name, calling loader() to open it if it isn't loaded
+
+        loader returns a Collection, or None if it couldn't be opened (nothing
+        is cached then, so the next call tries again).
+        """
+        collection = self.get(name)
+        if collection is not None:
+            return collection
+        with self.lock(name):
+            # Another session may have loaded it while we waited
+            collection = self.get(name)
+            if collection is None:
+                collection = loader()
+                if collection is not None:
+                    self.put(collection)
+        return collection
+
+    def put(self, collection):
+        """Add (or replace) a loaded collection and evict others if over the limit"""
+        collection.memory_bytes = directory_size(collection.knowledge_base.persist_directory)
+        with self._lock:
+            previous = self._collections.pop(collection.name, None)
+            self._collections[collection.name] = collection
+            if previous is not None and previous.vectorstore is collection.vectorstore:
+                # A rebuilt collection shares the vector store; questions still
+                # using the old one finish on it, and the store isn't closed
+                # before they do
+                previous.predecessor = None
+                collection.predecessor = previous
+                previous = None
+            elif previous is not None:
+                previous.retired = True
+        if previous is not None:
+            self._release(previous)
+        self._evict()
+
+    @contextmanager
+    def checkout(self, name, loader):
+        """Load the collection called name and keep it open until the block exits
+
+        Yields None if it couldn't be loaded.
+        """
+        while True:
+            collection = self.load(name, loader)
+            if collection is None:
+                break
+            with self._lock:
+                # It may have been evicted between loading and here
+                if self._collections.get(name) is collection:
+                    collection.in_use += 1
+                    break
+        try:
+            yield collection
+        finally:
+            if collection is not None:
+                with self._lock:
+                    collection.in_use -= 1
+                self._release(collection)
+                self._evict()
+
+    def wait_until_idle(self, collection, timeout=60.0, interval=0.05):
+        """Block until no question is using collection; returns False if timeout passes first"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not collection.in_use:
+                    return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+    def _evict(self):
+        evicted = []
+        with self._lock:
+            used = sum(collection.memory_bytes for collection in self._collections.values())
+            # Oldest first; the most recently used collection always stays
+            for name in list(self._collections)[:-1]:
+                if used <= self.memory_limit_bytes:
+                    break
+                collection = self._collections[name]
+                if collection.busy():
+                    continue
+                del self._collections[name]
+                collection.retired = True
+                used -= collection.memory_bytes
+                evicted.append(collection)
+            self.evictions += len(evicted)
+        for collection in evicted:
+            self._release(collection)
+
+    def _release(self, collection):
+        """Close a collection the cache has dropped once no question is using it"""
+        with self._lock:
+            if not collection.retired or collection.busy():
+                return
+            collection.retired = False
+        # Sessions look collections up on every rerun, so the next one to ask
+        # for it reloads it from disk
+        try:
+            collection.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": list(self._collections),
+                "memory_bytes": sum(collection.memory_bytes for collection in self._collections.values()),
+                "memory_limit_bytes": self.memory_limit_bytes,
+                "evictions": self.evictions,
+            }
@@ -1,16 +1,30 @@
 import streamlit as st
 import os
-import json
+from concurrent.futures import wait
 from datetime import datetime
 from dotenv import load_dotenv
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_community.vectorstores import Chroma
-from dotenv import load_dotenv
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
+# Only lightweight modules are imported here. LangChain, OpenAI, httpx and
+# numpy are imported by the functions that first need them, so the landing
+# page paints without paying for them; see benchmark_startup.py
+from indexing import (
+    KNOWLEDGE_BASE_DIRECTORY,
+    PERSIST_DIRECTORY,
+    index_version,
+    iter_knowledge_base,
+    list_knowledge_base,
+    load_manifest,
+    make_text_splitter,
+    open_vectorstore,
+    sync_vectorstore,
+    validate_index,
+)
+from knowledge_bases import Collection, CollectionCache, discover_knowledge_bases
+from hot_reload import KnowledgeBaseWatcher
+from chunk_metadata import ChunkMetadataIndex
+from conversation_export import ConversationExporter
+from conversation_store import ConversationStore, new_conversation_id
+from embedding_pipeline import EmbeddingPipeline, EmbeddingPipelineError
+from context_budget import compact_history
 
 # Load environment variables
 # Support both local .env file and Streamlit Cloud secrets
@@ -20,8 +34,12 @@ load_dotenv()
 def get_api_key():
     """Get OpenAI API key from environment or Streamlit secrets"""
     # Try Streamlit secrets first (for cloud deployment)
-    if hasattr(st, 'secrets') and 'OPENAI_API_KEY' in st.secrets:
-        return st.secrets['OPENAI_API_KEY']
+    try:
+        if hasattr(st, 'secrets') and 'OPENAI_API_KEY' in st.secrets:
+            return st.secrets['OPENAI_API_KEY']
+    except FileNotFoundError:
+        # No secrets.toml (local development)
+        pass
     # Fall back to environment variable (for local development)
     return os.getenv("OPENAI_API_KEY")
 
@@ -30,6 +48,76 @@ api_key = get_api_key()
 if api_key:
     os.environ["OPENAI_API_KEY"] = api_key
 
+# Performance tuning (override via environment variables)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+# "build" indexes knowledge_base/ from the sidebar; "prebuilt" only opens the
+# index produced by build_index.py and never embeds documents
+INDEX_MODE = os.getenv("INDEX_MODE", "build").lower()
+# "hybrid" fuses vector and BM25 results, "vector" or "lexical" use one of them
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+# Model that rewrites follow-up questions; a cheaper one keeps follow-ups fast
+CONDENSE_MODEL = os.getenv("CONDENSE_MODEL", "gpt-3.5-turbo")
+# Standalone questions skip the condense call unless this is false
+SKIP_CONDENSE = os.getenv("SKIP_CONDENSE", "true").lower() == "true"
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+VECTOR_SEARCH_TIMEOUT = float(os.getenv("VECTOR_SEARCH_TIMEOUT", "5"))
+# Candidates fetched and re-ranked (MMR) before the top RETRIEVAL_K are kept; 0 disables
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+# Optional local cross-encoder (needs sentence-transformers), e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_REQUESTS_PER_MINUTE = float(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "500"))
+# Chunks embedded and committed per ingestion batch; bounds memory while indexing
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "512"))
+# Chunks follow headings, paragraphs and lists, up to this many tokens each
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "300"))
+# Processes that split changed documents; worth raising for large knowledge bases
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "1"))
+# Neighbouring chunks of the same section added per retrieved chunk while the
+# context budget has room; 0 disables
+NEIGHBOR_CHUNKS = int(os.getenv("NEIGHBOR_CHUNKS", "1"))
+# "chroma" or "numpy" (in-process, memory-mapped); the numpy backend can
+# store float32/float16/int8 vectors and search them flat or through IVF lists
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "float16").lower()
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "flat").lower()
+IVF_PROBES = int(os.getenv("IVF_PROBES", "8"))
+# Each folder under KNOWLEDGE_BASES_DIRECTORY is another named knowledge base,
+# indexed into KNOWLEDGE_BASE_INDEXES/<name>; knowledge_base/ stays "default"
+KNOWLEDGE_BASES_DIRECTORY = os.getenv("KNOWLEDGE_BASES_DIRECTORY", "knowledge_bases/")
+KNOWLEDGE_BASE_INDEXES = os.getenv("KNOWLEDGE_BASE_INDEXES", "./indexes")
+# Loaded collections are evicted, least recently used first, beyond this estimate
+COLLECTION_MEMORY_LIMIT_MB = int(os.getenv("COLLECTION_MEMORY_LIMIT_MB", "1024"))
+# In build mode, re-index knowledge bases in the background when their files change
+HOT_RELOAD = os.getenv("HOT_RELOAD", "true").lower() == "true"
+HOT_RELOAD_INTERVAL = float(os.getenv("HOT_RELOAD_INTERVAL", "2"))
+# Identical questions sent without history at the same time share one pipeline run
+COALESCE_QUESTIONS = os.getenv("COALESCE_QUESTIONS", "true").lower() == "true"
+# Messages live in this SQLite file rather than session state; the chat shows
+# the latest HISTORY_PAGE_SIZE and pages back from there
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "./conversations/conversations.sqlite3")
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+# Questions whose model calls may be in flight at once across all sessions;
+# others queue (served round-robin by session) for up to QUEUE_TIMEOUT seconds
+MAX_CONCURRENT_QUESTIONS = int(os.getenv("MAX_CONCURRENT_QUESTIONS", "16"))
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", "64"))
+QUEUE_MAX_PER_SESSION = int(os.getenv("QUEUE_MAX_PER_SESSION", "2"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "15"))
+# Query embeddings and vector searches started within this many milliseconds
+# of each other, across sessions, go out as one batch (0 disables)
+MICRO_BATCH_WINDOW_MS = float(os.getenv("MICRO_BATCH_WINDOW_MS", "5"))
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "32"))
+# Connections to OpenAI shared by every session's questions
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+
 # Page configuration
 st.set_page_config(
     page_title="AI Learning Assistant",
@@ -143,103 +231,241 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # Initialize session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-if "conversation" not in st.session_state:
-    st.session_state.conversation = None
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
-if "vectorstore" not in st.session_state:
-    st.session_state.vectorstore = None
-
-@st.cache_resource
-def load_documents():
-    """Load documents from the knowledge_base folder with improved error handling"""
+# Messages are in the conversation store; the session keeps the conversation
+# ID (also in the URL, so a reload or restart resumes it) and how many to show
+if "conversation_id" not in st.session_state:
+    st.session_state.conversation_id = st.query_params.get("conversation") or new_conversation_id()
+    st.session_state.chat_history = None
+if "history_window" not in st.session_state:
+    st.session_state.history_window = HISTORY_PAGE_SIZE
+if "knowledge_base" not in st.session_state:
+    st.session_state.knowledge_base = None
+# Knowledge bases this session initialized (build mode); they reload on demand
+if "initialized_knowledge_bases" not in st.session_state:
+    st.session_state.initialized_knowledge_bases = set()
+if "stream_responses" not in st.session_state:
+    st.session_state.stream_responses = STREAM_RESPONSES
+
+def find_documents(knowledge_base):
+    """Find the documents in a knowledge base folder with improved error handling"""
     try:
         # Check if directory exists
-        if not os.path.exists('knowledge_base/'):
+        if not os.path.exists(knowledge_base.directory):
             st.error("❌ Knowledge base folder not found!")
-            st.info("Please create a 'knowledge_base' folder and add .txt documents.")
+            st.info(f"Please create a '{knowledge_base.directory.rstrip('/')}' folder and add .txt documents.")
             return []
 
-        # Load documents
-        loader = DirectoryLoader(
-            'knowledge_base/',
-            glob="**/*.txt",
-            loader_cls=TextLoader,
-            show_progress=False,
-            use_multithreading=True
-        )
-        documents = loader.load()
+        # Only list the files; they are read one at a time while indexing
+        paths = list_knowledge_base(knowledge_base.directory)
 
-        # Validate documents loaded
-        if not documents:
-            st.warning("⚠️ No documents found in knowledge_base folder!")
-            st.info("Please add .txt files to the knowledge_base folder.")
+        # Validate documents found
+        if not paths:
+            st.warning("⚠️ No documents found in the knowledge base folder!")
+            st.info(f"Please add .txt files to {knowledge_base.directory}")
             return []
 
         # Log success
-        st.info(f"📚 Successfully loaded {len(documents)} document(s)")
-        return documents
+        st.info(f"📚 Found {len(paths)} document(s)")
+        return paths
 
     except PermissionError:
-        st.error("❌ Permission denied: Cannot access knowledge_base folder")
-        return []
-    except UnicodeDecodeError as e:
-        st.error(f"❌ Encoding error in one of the documents: {str(e)}")
-        st.info("Ensure all text files are UTF-8 encoded")
+        st.error("❌ Permission denied: Cannot access the knowledge base folder")
         return []
     except Exception as e:
-        st.error(f"❌ Unexpected error loading documents: {str(e)}")
+        st.error(f"❌ Unexpected error finding documents: {str(e)}")
         st.info("Please check the application logs for more details")
         return []
 
 @st.cache_resource
-def create_vectorstore(_documents):
-    """Create vector store from documents with improved error handling"""
-    try:
-        if not _documents:
-            st.error("❌ No documents provided to create vector store")
-            return None
+def get_async_runtime():
+    """Start the event loop and HTTP connection pool shared by every session"""
+    from async_runtime import AsyncRuntime
 
-        # Split documents into chunks
-        st.info("🔄 Splitting documents into chunks...")
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
-        chunks = text_splitter.split_documents(_documents)
+    return AsyncRuntime(max_connections=HTTP_MAX_CONNECTIONS)
 
-        if not chunks:
-            st.error("❌ No text chunks created from documents")
+@st.cache_resource
+def get_embedding_cache():
+    """Open the on-disk embedding cache shared by every session"""
+    from embedding_cache import EmbeddingCache
+
+    return EmbeddingCache(EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+
+@st.cache_resource
+def get_embeddings():
+    """Create the OpenAI embeddings client backed by the shared on-disk cache"""
+    from langchain_openai import OpenAIEmbeddings
+    from embedding_cache import CachedEmbeddings
+    from instrumentation import TimedEmbeddings
+    from micro_batching import BatchedQueryEmbeddings
+
+    # Only cache misses reach the network, so only those are timed and charged;
+    # concurrent misses share one embedding request
+    runtime = get_async_runtime()
+    client = OpenAIEmbeddings(http_client=runtime.http_client, http_async_client=runtime.http_async_client)
+    client = BatchedQueryEmbeddings(client, MICRO_BATCH_WINDOW_MS / 1000, MICRO_BATCH_MAX_SIZE)
+    return CachedEmbeddings(TimedEmbeddings(client), get_embedding_cache())
+
+@st.cache_resource
+def get_metrics():
+    """Create the process-wide store of per-question latency and cost traces"""
+    from instrumentation import MetricsRecorder
+
+    return MetricsRecorder()
+
+@st.cache_resource
+def get_single_flight():
+    """Create the process-wide coalescer of identical in-flight questions"""
+    from coalescing import SingleFlight
+
+    return SingleFlight()
+
+@st.cache_resource
+def get_scheduler():
+    """Admission control for every session's model calls"""
+    from admission import FairScheduler
+
+    return FairScheduler(
+        max_concurrency=MAX_CONCURRENT_QUESTIONS,
+        max_queue=QUEUE_MAX_DEPTH,
+        max_queued_per_session=QUEUE_MAX_PER_SESSION,
+        max_wait=QUEUE_TIMEOUT
+    )
+
+@st.cache_resource
+def get_conversation_store():
+    """Conversation store shared by every session"""
+    return ConversationStore(CONVERSATION_DB_PATH)
+
+@st.cache_resource
+def get_knowledge_bases():
+    """Find the named knowledge bases once per process"""
+    return discover_knowledge_bases(
+        KNOWLEDGE_BASE_DIRECTORY,
+        PERSIST_DIRECTORY,
+        KNOWLEDGE_BASES_DIRECTORY,
+        KNOWLEDGE_BASE_INDEXES
+    )
+
+@st.cache_resource
+def get_collections():
+    """Create the process-wide cache of loaded knowledge base collections"""
+    return CollectionCache(memory_limit_bytes=COLLECTION_MEMORY_LIMIT_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_watcher():
+    """Start the background watcher that hot-reloads changed knowledge bases"""
+    return KnowledgeBaseWatcher(reload_collection, interval=HOT_RELOAD_INTERVAL).start()
+
+def open_configured_vectorstore(embeddings, persist_directory):
+    """Open the vector backend selected by VECTOR_BACKEND"""
+    return open_vectorstore(
+        embeddings,
+        persist_directory,
+        VECTOR_BACKEND,
+        quantization=VECTOR_QUANTIZATION,
+        index_type=VECTOR_INDEX,
+        probes=IVF_PROBES
+    )
+
+def make_answer_cache():
+    """Create a knowledge base's semantic answer cache"""
+    from answer_cache import AnswerCache
+
+    # Answers are only reused within the knowledge base they came from
+    return AnswerCache(
+        similarity_threshold=ANSWER_CACHE_THRESHOLD,
+        ttl_seconds=ANSWER_CACHE_TTL_SECONDS
+    )
+
+def open_collection(knowledge_base, embeddings, vectorstore=None):
+    """Open a knowledge base's vector store (unless one is given), side indexes and answer cache"""
+    from lexical_index import LexicalIndex
+
+    persist_directory = knowledge_base.persist_directory
+    if vectorstore is None:
+        vectorstore = open_configured_vectorstore(embeddings, persist_directory)
+    return Collection(
+        knowledge_base,
+        vectorstore,
+        LexicalIndex.load(persist_directory),
+        ChunkMetadataIndex.load(persist_directory),
+        make_answer_cache()
+    )
+
+def create_collection(knowledge_base, paths):
+    """Index a knowledge base's documents and load its collection, with improved error handling"""
+    try:
+        if not paths:
+            st.error("❌ No documents provided to create vector store")
             return None
 
-        st.info(f"✅ Created {len(chunks)} text chunks")
+        # Splitter used for any new or changed documents
+        text_splitter = make_text_splitter(CHUNK_TOKENS)
 
         # Create embeddings
         st.info("🔄 Creating embeddings with OpenAI...")
         try:
-            embeddings = OpenAIEmbeddings()
+            embeddings = get_embeddings()
         except Exception as e:
             st.error(f"❌ Failed to initialize OpenAI embeddings: {str(e)}")
             st.info("Please check your OPENAI_API_KEY in the .env file")
             return None
 
-        # Create vector store
-        st.info("🔄 Building vector database...")
+        # Open the persisted vector store and re-index only what changed
+        st.info("🔄 Syncing vector database...")
+        progress_bar = st.progress(0.0)
+        pipeline = EmbeddingPipeline(
+            embeddings,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            concurrency=EMBEDDING_CONCURRENCY,
+            requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE
+        )
         try:
-            vectorstore = Chroma.from_documents(
-                documents=chunks,
-                embedding=embeddings,
-                persist_directory="./chroma_db"
+            collection = open_collection(knowledge_base, embeddings)
+            # Files are streamed and committed in batches, so memory stays
+            # bounded and progress survives an interruption
+            stats = sync_vectorstore(
+                collection.vectorstore,
+                iter_knowledge_base(paths),
+                text_splitter,
+                knowledge_base.persist_directory,
+                workers=INDEX_WORKERS,
+                pipeline=pipeline,
+                progress=lambda files_done, files_total, embedded: progress_bar.progress(
+                    files_done / files_total,
+                    text=f"Indexed {files_done}/{files_total} files ({embedded} chunks embedded)"
+                ),
+                lexical_index=collection.lexical_index,
+                chunk_index=collection.chunk_index,
+                batch_size=INGEST_BATCH_SIZE,
+                total=len(paths)
             )
-            st.success("✅ Vector store created successfully!")
-            return vectorstore
+            collection.answer_cache.set_index_version(stats["index_version"])
+        except EmbeddingPipelineError as e:
+            st.error(f"❌ Failed to embed documents: {str(e)}")
+            st.info("Finished batches were saved; initialize again to resume")
+            return None
+        except (UnicodeDecodeError, RuntimeError) as e:
+            st.error(f"❌ Failed to read a document: {str(e)}")
+            st.info("Ensure all text files are UTF-8 encoded; indexed files were saved")
+            return None
         except Exception as e:
             st.error(f"❌ Failed to create vector store: {str(e)}")
             return None
 
+        if not stats["chunks"]:
+            st.error("❌ No text chunks created from documents")
+            return None
+
+        st.info(
+            f"✅ Indexed {stats['chunks']} text chunks "
+            f"({stats['added']} embedded, {stats['deleted']} removed, {stats['unchanged']} unchanged)"
+        )
+        if stats["added"]:
+            st.info(f"⚡ Embedding throughput: {stats['chunks_per_second']:.1f} chunks/sec")
+        st.success("✅ Vector store created successfully!")
+        return initialize_conversation(collection)
+
     except ImportError as e:
         st.error(f"❌ Missing required package: {str(e)}")
         st.info("Please ensure all dependencies are installed")
@@ -248,103 +474,351 @@ def create_vectorstore(_documents):
         st.error(f"❌ Unexpected error creating vector store: {str(e)}")
         return None
 
-def initialize_conversation(vectorstore):
-    """Initialize the conversational retrieval chain"""
+def reload_collection(knowledge_base, changes):
+    """Re-index a changed knowledge base and swap in a new chain (runs on the watcher thread)
+
+    Only the added and changed files are read, and only their new chunks
+    embedded. BM25 and chunk metadata indexes are rebuilt beside the live
+    ones. While the knowledge base is loaded, the shared vector store only
+    gains chunks until the new collection has replaced the old one in a
+    single cache update; chunks that are gone are deleted once questions
+    still running on the old chain have finished.
+    """
+    from indexing import can_sync_changes, delete_stale_vectors
+
+    collections = get_collections()
+    persist_directory = knowledge_base.persist_directory
+    with collections.checkout(knowledge_base.name, lambda: None) as current:
+        with collections.lock(knowledge_base.name):
+            embeddings = get_embeddings()
+            collection = open_collection(knowledge_base, embeddings, current.vectorstore if current else None)
+            pipeline = EmbeddingPipeline(
+                embeddings,
+                batch_size=EMBEDDING_BATCH_SIZE,
+                concurrency=EMBEDDING_CONCURRENCY,
+                requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE
+            )
+            text_splitter = make_text_splitter(CHUNK_TOKENS)
+            if changes and can_sync_changes(collection.vectorstore, text_splitter, persist_directory):
+                paths, removed = changes["added"] + changes["changed"], changes["deleted"]
+            else:
+                paths, removed = list_knowledge_base(knowledge_base.directory), None
+            stats = sync_vectorstore(
+                collection.vectorstore,
+                iter_knowledge_base(paths),
+                text_splitter,
+                persist_directory,
+                workers=INDEX_WORKERS,
+                pipeline=pipeline,
+                lexical_index=collection.lexical_index,
+                chunk_index=collection.chunk_index,
+                batch_size=INGEST_BATCH_SIZE,
+                total=len(paths),
+                removed=removed,
+                defer_deletes=current is not None
+            )
+            if current is None:
+                # Not loaded right now: the index on disk is up to date for
+                # whoever opens it next
+                collection.close()
+                return stats
+
+            collection.answer_cache.set_index_version(stats["index_version"])
+            collection.chain = build_conversation_chain(collection)
+            collections.put(collection)
+
+    # Our own checkout is released; wait for questions on the old chain
+    if collections.wait_until_idle(current):
+        with collections.lock(knowledge_base.name):
+            # A later reload that replaced this collection deletes them instead
+            if collections.get(knowledge_base.name) is collection:
+                delete_stale_vectors(collection.vectorstore, persist_directory)
+    return stats
+
+def load_collection(knowledge_base):
+    """Open a knowledge base's persisted index without embedding any documents"""
     try:
-        # Create custom prompt template
-        prompt_template = """You are an AI Learning Assistant specialized in instructional design, eLearning, and learning theories.
-Use the following context to answer the question. If you don't know the answer based on the context, say so clearly.
-Always provide detailed, educational responses.
+        manifest = load_manifest(knowledge_base.persist_directory)
+        if manifest is None:
+            if INDEX_MODE == "prebuilt":
+                st.error("❌ No prebuilt index found!")
+                st.info(
+                    f"Run `python build_index.py --name {knowledge_base.name}` and deploy "
+                    f"the {knowledge_base.persist_directory} folder with the app"
+                )
+            else:
+                st.error("❌ This knowledge base hasn't been indexed yet")
+                st.info("Click 'Initialize Knowledge Base' to index it")
+            return None
 
-Context: {context}
+        collection = open_collection(knowledge_base, get_embeddings())
+        problems = validate_index(collection.vectorstore, knowledge_base.persist_directory, collection.lexical_index)
+        if problems:
+            for problem in problems:
+                st.error(f"❌ Index is inconsistent: {problem}")
+            st.info(f"Rebuild it with `python build_index.py --name {knowledge_base.name}`")
+            collection.close()
+            return None
 
-Question: {question}
+        collection.answer_cache.set_index_version(index_version(manifest["files"]))
+        return initialize_conversation(collection)
+    except Exception as e:
+        st.error(f"❌ Failed to open index: {str(e)}")
+        return None
 
-Answer:"""
+@st.cache_resource
+def get_prompt():
+    """Compile the answer prompt once per process"""
+    from rag_chain import make_answer_prompt
 
-        PROMPT = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question"]
-        )
+    return make_answer_prompt()
 
-        # Initialize memory
-        memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True,
-            output_key="answer"
-        )
+@st.cache_resource
+def get_llm():
+    """Create the shared answer model; it streams its tokens"""
+    from langchain_openai import ChatOpenAI
+
+    runtime = get_async_runtime()
+    return ChatOpenAI(
+        model_name="gpt-3.5-turbo",
+        temperature=0.7,
+        streaming=True,
+        http_client=runtime.http_client,
+        http_async_client=runtime.http_async_client
+    )
 
-        # Create LLM
-        llm = ChatOpenAI(
-            model_name="gpt-3.5-turbo",
-            temperature=0.7
-        )
+@st.cache_resource
+def get_condense_llm():
+    """Create the shared model that condenses follow-up questions
 
-        # Create conversational chain
-        conversation = ConversationalRetrievalChain.from_llm(
-            llm=llm,
-            retriever=vectorstore.as_retriever(search_kwargs={"k": 3}),
-            memory=memory,
-            return_source_documents=True,
-            combine_docs_chain_kwargs={"prompt": PROMPT}
-        )
+    It doesn't stream, so only answer tokens reach the chat message.
+    """
+    from langchain_openai import ChatOpenAI
 
-        return conversation
-    except Exception as e:
-        st.error(f"Error initializing conversation: {str(e)}")
-        return None
+    runtime = get_async_runtime()
+    return ChatOpenAI(
+        model_name=CONDENSE_MODEL,
+        temperature=0,
+        http_client=runtime.http_client,
+        http_async_client=runtime.http_async_client
+    )
 
-def format_sources(source_documents):
-    """Format source documents for display"""
-    sources = []
-    for i, doc in enumerate(source_documents, 1):
-        source_name = os.path.basename(doc.metadata.get('source', 'Unknown'))
-        content_preview = doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
-        sources.append(f"**Source {i}: {source_name}**\n\n{content_preview}")
-    return "\n\n---\n\n".join(sources)
-
-def export_conversation_json():
-    """Export conversation history as JSON"""
+@st.cache_resource
+def get_cross_encoder():
+    """Load the optional local re-ranking model once per process"""
+    from reranking import load_cross_encoder
+
+    cross_encoder = load_cross_encoder(RERANKER_MODEL)
+    if RERANKER_MODEL and cross_encoder is None:
+        st.warning("⚠️ RERANKER_MODEL is set but sentence-transformers isn't installed; using MMR only")
+    return cross_encoder
+
+def build_conversation_chain(collection):
+    """Build a collection's conversational retrieval chain, shared by every session using it
+
+    The chain holds no memory; each session passes its own chat_history.
+    """
+    from rag_chain import make_conversation_chain, make_retriever
+
+    retriever = make_retriever(
+        collection.vectorstore,
+        collection.lexical_index,
+        k=RETRIEVAL_K,
+        mode=RETRIEVAL_MODE,
+        vector_timeout=VECTOR_SEARCH_TIMEOUT,
+        max_tokens=CONTEXT_TOKEN_BUDGET,
+        candidates=RERANK_CANDIDATES,
+        mmr_lambda=MMR_LAMBDA,
+        cross_encoder=get_cross_encoder(),
+        chunk_index=collection.chunk_index,
+        neighbor_chunks=NEIGHBOR_CHUNKS,
+        batch_window=MICRO_BATCH_WINDOW_MS / 1000,
+        max_batch_size=MICRO_BATCH_MAX_SIZE
+    )
+    return make_conversation_chain(get_llm(), get_condense_llm(), retriever, get_prompt())
+
+def initialize_conversation(collection):
+    """Initialize a collection's conversational retrieval chain"""
     try:
-        export_data = {
-            "export_date": datetime.now().isoformat(),
-            "total_messages": len(st.session_state.messages),
-            "conversation": st.session_state.messages
-        }
-        return json.dumps(export_data, indent=2)
+        collection.chain = build_conversation_chain(collection)
+        return collection
     except Exception as e:
-        st.error(f"Error exporting to JSON: {str(e)}")
+        st.error(f"Error initializing conversation: {str(e)}")
+        collection.close()
         return None
 
-def export_conversation_txt():
-    """Export conversation history as plain text"""
-    try:
-        lines = [
-            "AI Learning Assistant - Conversation Export",
-            f"Export Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-            f"Total Messages: {len(st.session_state.messages)}",
-            "=" * 80,
-            ""
-        ]
-
-        for i, msg in enumerate(st.session_state.messages, 1):
-            role = "You" if msg["role"] == "user" else "Assistant"
-            lines.append(f"Message {i} - {role}:")
-            lines.append("-" * 40)
-            lines.append(msg["content"])
-
-            if "sources" in msg:
-                lines.append("\nSources:")
-                lines.append(msg["sources"])
-
-            lines.append("\n" + "=" * 80 + "\n")
-
-        return "\n".join(lines)
-    except Exception as e:
-        st.error(f"Error exporting to text: {str(e)}")
-        return None
+def get_collection(knowledge_base):
+    """The knowledge base's shared collection, opening its persisted index on first use"""
+    return get_collections().load(knowledge_base.name, lambda: load_collection(knowledge_base))
+
+def format_sources(collection, source_ids):
+    """Format the chunks an answer used for display"""
+    return collection.chunk_index.render_sources(source_ids)
+
+def add_message(role, content, source_ids=None):
+    """Append a message to this session's conversation"""
+    get_conversation_store().append(st.session_state.conversation_id, role, content, source_ids)
+
+def restore_chat_history():
+    """Rebuild the condensing history of a resumed conversation from its latest turns"""
+    messages = get_conversation_store().page(st.session_state.conversation_id, HISTORY_PAGE_SIZE)
+    turns = [
+        (question["content"], answer["content"])
+        for question, answer in zip(messages, messages[1:])
+        if question["role"] == "user" and answer["role"] == "assistant" and not answer["content"].startswith(("❌", "⏳"))
+    ]
+    return compact_history(turns, HISTORY_TOKEN_BUDGET)
+
+def start_new_conversation():
+    """Start a new conversation for this session; the shared chains are untouched"""
+    st.session_state.conversation_id = new_conversation_id()
+    st.session_state.chat_history = []
+    st.session_state.history_window = HISTORY_PAGE_SIZE
+    st.query_params["conversation"] = st.session_state.conversation_id
+
+def render_chat_history(collection):
+    """Show the latest history_window messages, with a button to page further back"""
+    store = get_conversation_store()
+    messages = store.page(st.session_state.conversation_id, st.session_state.history_window)
+    if messages and messages[0]["turn"] > 0:
+        if st.button(f"⬆️ Load earlier messages ({messages[0]['turn']} more)"):
+            st.session_state.history_window += HISTORY_PAGE_SIZE
+            st.rerun()
+    for message in messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+            if "source_ids" in message:
+                with st.expander("📄 View Sources"):
+                    st.markdown(format_sources(collection, message["source_ids"]))
+
+async def run_pipeline(collection, prompt, chat_history, callbacks, use_answer_cache):
+    """Answer one question from the answer cache or the chain; returns (response, cached)"""
+    # Answer from the semantic cache when a question sent without history
+    # (a first question or a standalone follow-up) was already answered
+    question_embedding = None
+    if use_answer_cache:
+        try:
+            question_embedding = await get_embeddings().aembed_query(prompt)
+            response = collection.answer_cache.lookup(question_embedding)
+        except Exception:
+            # Embeddings unavailable; the retriever falls back to BM25
+            question_embedding = None
+            response = None
+        if response:
+            return response, True
+
+    response = await collection.chain.ainvoke(
+        {"question": prompt, "chat_history": chat_history},
+        config={"callbacks": callbacks}
+    )
+    if question_embedding is not None:
+        collection.answer_cache.store(prompt, question_embedding, response)
+    return response, False
+
+async def answer_question_async(collection, session, prompt, chat_history, callbacks, on_token, use_answer_cache):
+    """Answer one question on the shared event loop; returns (response, cached, coalesced)
+
+    The pipeline's model calls wait for a slot from the shared scheduler,
+    queued fairly against other sessions; admission.Busy is raised if none
+    frees up in time. Questions asked without history (the same words mean
+    the same thing in any session) join an identical question already in
+    flight against the same index instead of running the pipeline again.
+    """
+    from instrumentation import TokenCallbackHandler
+    from coalescing import normalize_question
+
+    scheduler = get_scheduler()
+    if chat_history or not COALESCE_QUESTIONS:
+        if on_token:
+            callbacks = callbacks + [TokenCallbackHandler(on_token)]
+        response, cached = await scheduler.run(
+            session, lambda: run_pipeline(collection, prompt, chat_history, callbacks, use_answer_cache)
+        )
+        return response, cached, False
+
+    key = (collection.name, collection.answer_cache.index_version, normalize_question(prompt))
+    (response, cached), coalesced = await get_single_flight().run(
+        key,
+        lambda publish: scheduler.run(session, lambda: run_pipeline(
+            collection, prompt, chat_history, callbacks + [TokenCallbackHandler(publish)], use_answer_cache
+        )),
+        on_token
+    )
+    return response, cached or coalesced, coalesced
+
+def answer_question(collection, prompt, answer_placeholder):
+    """Answer a question for this session from the collection's answer cache or chain"""
+    from instrumentation import TokenStreamHandler, TraceCallbackHandler
+    from rag_chain import is_standalone_question
+
+    with get_metrics().trace(prompt) as trace:
+        # Generate response, streaming tokens into the message
+        callbacks = [TraceCallbackHandler(trace)]
+        token_handler = None
+        if st.session_state.stream_responses:
+            token_handler = TokenStreamHandler()
+
+        # Self-contained questions don't need rewriting, so send them without
+        # history; that skips the condense call and lets the answer cache serve them
+        chat_history = list(st.session_state.chat_history)
+        if SKIP_CONDENSE and is_standalone_question(prompt, chat_history):
+            chat_history = []
+
+        # The network round trips run on the shared event loop; this thread
+        # only waits for them and renders streamed tokens
+        future = get_async_runtime().submit(answer_question_async(
+            collection,
+            st.session_state.conversation_id,
+            prompt,
+            chat_history,
+            callbacks,
+            token_handler.on_llm_new_token if token_handler else None,
+            use_answer_cache=not chat_history and RETRIEVAL_MODE != "lexical"
+        ))
+        while not future.done():
+            wait([future], timeout=0.05)
+            # Tokens arrive on the shared event loop, where Streamlit calls
+            # aren't allowed, so they're rendered from this thread
+            if token_handler and token_handler.drain():
+                answer_placeholder.markdown(token_handler.text + "▌")
+        response, trace.cached, trace.coalesced = future.result()
+        return response
+
+def render_latency_stats():
+    """Show per-stage latency percentiles and the metrics export in the sidebar"""
+    metrics = get_metrics()
+    if not len(metrics):
+        return
+
+    summary = metrics.summary()
+    col1, col2 = st.columns(2)
+    col1.metric("Latency p50", f"{summary['total']['p50']:.2f}s")
+    col2.metric("Latency p95", f"{summary['total']['p95']:.2f}s")
+
+    with st.expander("⏱️ Stage Latency (all sessions)"):
+        rows = ["| Stage | p50 | p95 | p99 |", "|---|---|---|---|"]
+        for stage in ("queue", "condense", "embed_query", "retrieve", "generate", "total"):
+            stats = summary[stage]
+            rows.append(f"| {stage} | {stats['p50']:.2f}s | {stats['p95']:.2f}s | {stats['p99']:.2f}s |")
+        st.markdown("\n".join(rows))
+        st.caption(f"{summary['requests']} requests · avg cost ${summary['mean_cost_usd']:.4f} per question")
+
+    st.download_button(
+        label="📈 Metrics (JSONL)",
+        data=metrics.export_jsonl(),
+        file_name=f"rag_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl",
+        mime="application/x-ndjson",
+        use_container_width=True
+    )
 
 def main():
+    # Keep the conversation in the URL so reloading the page resumes it
+    if st.query_params.get("conversation") != st.session_state.conversation_id:
+        st.query_params["conversation"] = st.session_state.conversation_id
+    if st.session_state.chat_history is None:
+        # A resumed conversation picks its follow-up context back up
+        st.session_state.chat_history = restore_chat_history()
+
     # Header
     st.title("🎓 AI Learning Assistant")
     st.markdown("### Your intelligent guide to instructional design and eLearning")
@@ -375,65 +849,136 @@ def main():
         else:
             st.success("✅ API key configured")
 
+        st.toggle("⚡ Stream responses", key="stream_responses")
+
+        # Knowledge base selector; switching starts a new conversation
+        knowledge_bases = get_knowledge_bases()
+        if st.session_state.knowledge_base not in knowledge_bases:
+            st.session_state.knowledge_base = next(iter(knowledge_bases))
+        if len(knowledge_bases) > 1:
+            st.selectbox(
+                "📚 Knowledge base",
+                list(knowledge_bases),
+                key="knowledge_base",
+                on_change=start_new_conversation
+            )
+        knowledge_base = knowledge_bases[st.session_state.knowledge_base]
+
+        # Collections are shared by every session and may have been evicted
+        # since the last rerun; get_collection reopens them from disk
+        collection = None
+        if INDEX_MODE == "prebuilt":
+            # Open the shipped index on first use; nothing is embedded here
+            collection = get_collection(knowledge_base)
+            if collection:
+                st.success("✅ Prebuilt knowledge base loaded")
+        elif knowledge_base.name in st.session_state.initialized_knowledge_bases:
+            collection = get_collection(knowledge_base)
+        if collection and INDEX_MODE != "prebuilt" and HOT_RELOAD:
+            # Pick up edits to the documents without a restart
+            get_watcher().watch(knowledge_base)
+
         # Initialize button
-        if st.button("🔄 Initialize Knowledge Base", use_container_width=True):
+        if INDEX_MODE != "prebuilt" and st.button("🔄 Initialize Knowledge Base", use_container_width=True):
             with st.spinner("Loading documents and creating vector store..."):
-                documents = load_documents()
-                if documents:
-                    st.session_state.vectorstore = create_vectorstore(documents)
-                    if st.session_state.vectorstore:
-                        st.session_state.conversation = initialize_conversation(st.session_state.vectorstore)
-                        st.success(f"✅ Loaded {len(documents)} documents!")
+                paths = find_documents(knowledge_base)
+                if paths:
+                    # Sessions share the collection, so it's only indexed once;
+                    # a failure isn't cached, so the next click retries (and resumes)
+                    collection = get_collections().load(
+                        knowledge_base.name,
+                        lambda: create_collection(knowledge_base, paths)
+                    )
+                    if collection:
+                        st.session_state.initialized_knowledge_bases.add(knowledge_base.name)
+                        if HOT_RELOAD:
+                            get_watcher().watch(knowledge_base)
+                        st.success(f"✅ Loaded {len(paths)} documents!")
                 else:
-                    st.error("No documents found in knowledge_base folder")
+                    st.error(f"No documents found in {knowledge_base.directory}")
 
         st.divider()
 
         # Clear conversation button
         if st.button("🗑️ Clear Conversation", use_container_width=True):
-            st.session_state.messages = []
-            st.session_state.chat_history = []
-            if st.session_state.vectorstore:
-                st.session_state.conversation = initialize_conversation(st.session_state.vectorstore)
+            # The chain is shared; only this session's history is reset
+            start_new_conversation()
             st.rerun()
 
         st.divider()
 
         # Export conversation
         st.markdown("**💾 Export Conversation**")
-        if len(st.session_state.messages) > 0:
+        store = get_conversation_store()
+        conversation_id = st.session_state.conversation_id
+        message_count = store.count(conversation_id)
+        if message_count > 0 and collection:
+            # Exports are only built when a button is clicked, reading the
+            # conversation from the store a batch at a time
+            exporter = ConversationExporter(collection.chunk_index)
             col1, col2 = st.columns(2)
 
             with col1:
-                txt_export = export_conversation_txt()
-                if txt_export:
-                    st.download_button(
-                        label="📄 TXT",
-                        data=txt_export,
-                        file_name=f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                        mime="text/plain",
-                        use_container_width=True
-                    )
+                st.download_button(
+                    label="📄 TXT",
+                    data=lambda: exporter.to_txt(store.iter_messages(conversation_id), message_count),
+                    file_name=f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                    mime="text/plain",
+                    use_container_width=True
+                )
 
             with col2:
-                json_export = export_conversation_json()
-                if json_export:
-                    st.download_button(
-                        label="📋 JSON",
-                        data=json_export,
-                        file_name=f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                        mime="application/json",
-                        use_container_width=True
-                    )
+                st.download_button(
+                    label="📋 JSON",
+                    data=lambda: exporter.to_json(store.iter_messages(conversation_id), message_count),
+                    file_name=f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                    mime="application/json",
+                    use_container_width=True
+                )
         else:
             st.info("Start a conversation to enable export")
 
         st.divider()
         st.markdown("**📊 Statistics**")
-        st.metric("Messages", len(st.session_state.messages))
+        st.metric("Messages", message_count)
+        if collection:
+            cache_stats = get_embedding_cache().stats()
+            col1, col2 = st.columns(2)
+            col1.metric("Embedding cache hits", cache_stats["hits"])
+            col2.metric("Embedding cache misses", cache_stats["misses"])
+            col1, col2 = st.columns(2)
+            col1.metric("Cached answers served", collection.answer_cache.stats()["hits"])
+            col2.metric("Coalesced questions", get_single_flight().coalesced)
+            queue_stats = get_scheduler().stats()
+            col1, col2 = st.columns(2)
+            col1.metric("Queue depth", queue_stats["waiting"])
+            col2.metric("Queue wait p95", f"{queue_stats['wait_p95']:.2f}s")
+            st.caption(
+                f"🚦 {queue_stats['active']}/{queue_stats['max_concurrency']} questions in flight · "
+                f"{queue_stats['shed']} turned away"
+            )
+        if INDEX_MODE != "prebuilt" and HOT_RELOAD:
+            watcher_stats = get_watcher().stats()
+            if watcher_stats["last_error"]:
+                st.warning(f"⚠️ Hot reload failed ({watcher_stats['last_error']}); retrying")
+            elif watcher_stats["last_reload"]:
+                reloaded_at = datetime.fromtimestamp(watcher_stats["last_reload"]).strftime("%H:%M:%S")
+                st.caption(f"🔄 Knowledge base updated at {reloaded_at} ({watcher_stats['reloads']} reloads)")
+        if len(knowledge_bases) > 1:
+            collection_stats = get_collections().stats()
+            st.caption(
+                f"{len(collection_stats['loaded'])} knowledge base(s) loaded · "
+                f"{collection_stats['memory_bytes'] / 2**20:.0f} of "
+                f"{collection_stats['memory_limit_bytes'] / 2**20:.0f} MB · "
+                f"{collection_stats['evictions']} evicted"
+            )
+        if collection:
+            # Metrics need the instrumentation (LangChain) imports, which the
+            # landing page doesn't pay for
+            render_latency_stats()
 
     # Main chat interface
-    if st.session_state.conversation is None:
+    if collection is None:
         st.info("👆 Click 'Initialize Knowledge Base' in the sidebar to get started!")
         st.markdown("""
         ### How to use:
@@ -448,18 +993,13 @@ def main():
         - How do adults learn differently?
         """)
     else:
-        # Display chat history
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
-                if "sources" in message:
-                    with st.expander("📄 View Sources"):
-                        st.markdown(message["sources"])
+        # Display the latest page of the chat history
+        render_chat_history(collection)
 
         # Chat input
         if prompt := st.chat_input("Ask a question about learning and instructional design..."):
             # Add user message
-            st.session_state.messages.append({"role": "user", "content": prompt})
+            add_message("user", prompt)
             with st.chat_message("user"):
                 st.markdown(prompt)
 
@@ -467,54 +1007,62 @@ def main():
             with st.chat_message("assistant"):
                 with st.spinner("Thinking..."):
                     try:
-                        # Validate conversation is initialized
-                        if not st.session_state.conversation:
-                            error_msg = "❌ Conversation not initialized. Please initialize the knowledge base first."
-                            st.error(error_msg)
-                            st.session_state.messages.append({
-                                "role": "assistant",
-                                "content": error_msg
-                            })
-                            return
-
-                        # Generate response
-                        response = st.session_state.conversation({
-                            "question": prompt
-                        })
+                        answer_placeholder = st.empty()
+                        # Check the collection out so it isn't closed mid-answer
+                        with get_collections().checkout(
+                            knowledge_base.name,
+                            lambda: load_collection(knowledge_base)
+                        ) as collection:
+                            # Validate conversation is initialized
+                            if not collection:
+                                error_msg = "❌ Conversation not initialized. Please initialize the knowledge base first."
+                                st.error(error_msg)
+                                add_message("assistant", error_msg)
+                                return
+
+                            response = answer_question(collection, prompt, answer_placeholder)
 
                         answer = response.get("answer", "No answer generated")
                         source_documents = response.get("source_documents", [])
+                        # Keep only the recent turns that fit the history budget,
+                        # so condensing follow-ups stays flat in cost
+                        st.session_state.chat_history = compact_history(
+                            st.session_state.chat_history + [(prompt, answer)],
+                            HISTORY_TOKEN_BUDGET
+                        )
 
-                        # Display answer
-                        st.markdown(answer)
+                        # Display answer (replaces the streamed text)
+                        answer_placeholder.markdown(answer)
 
                         # Display sources
                         if source_documents:
-                            sources_text = format_sources(source_documents)
+                            # Messages keep chunk IDs; previews live in the chunk index
+                            source_ids = collection.chunk_index.references(source_documents)
                             with st.expander("📄 View Sources"):
-                                st.markdown(sources_text)
+                                st.markdown(format_sources(collection, source_ids))
 
                             # Add to messages with sources
-                            st.session_state.messages.append({
-                                "role": "assistant",
-                                "content": answer,
-                                "sources": sources_text
-                            })
+                            add_message("assistant", answer, source_ids)
                         else:
-                            st.session_state.messages.append({
-                                "role": "assistant",
-                                "content": answer
-                            })
+                            add_message("assistant", answer)
 
                     except KeyError as e:
                         error_msg = f"❌ Response format error: Missing key {str(e)}"
                         st.error(error_msg)
                         st.info("The AI model returned an unexpected response format")
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": error_msg
-                        })
+                        add_message("assistant", error_msg)
                     except Exception as e:
+                        # Imported here so the landing page doesn't pay for it
+                        from admission import Busy
+
+                        if isinstance(e, Busy):
+                            # Turned away by admission control rather than
+                            # queued behind a rate-limited API
+                            busy_msg = f"⏳ The assistant is {e.reason} right now. Please retry in {e.retry_after} s."
+                            st.warning(busy_msg)
+                            add_message("assistant", busy_msg)
+                            return
+
                         error_msg = f"❌ Error generating response: {str(e)}"
                         st.error(error_msg)
 
@@ -529,10 +1077,7 @@ def main():
                         else:
                             st.info("💡 Please try rephrasing your question or check the application logs")
 
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": error_msg
-                        })
+                        add_message("assistant", error_msg)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,125 @@
+"""BM25 lexical index over the knowledge base chunks"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from langchain_core.documents import Document
+
+LEXICAL_INDEX_FILENAME = "lexical_index.json"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase word tokens used for both indexing and queries"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class LexicalIndex:
+    """In-memory BM25 inverted index keyed by chunk ID
+
+    Only chunk texts and metadata are persisted; postings and statistics are
+    rebuilt on load, which is fast at knowledge base sizes.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._documents = {}
+        self._lengths = {}
+        self._postings = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def ids(self):
+        with self._lock:
+            return set(self._documents)
+
+    def get(self, cid):
+        """The indexed chunk with this ID, or None"""
+        return self._documents.get(cid)
+
+    def add(self, ids, documents):
+        """Index documents under the given chunk IDs, replacing existing ones"""
+        with self._lock:
+            for cid, document in zip(ids, documents):
+                self._remove(cid)
+                counts = Counter(tokenize(document.page_content))
+                self._documents[cid] = document
+                self._lengths[cid] = sum(counts.values())
+                self._total_length += self._lengths[cid]
+                for term, count in counts.items():
+                    self._postings.setdefault(term, {})[cid] = count
+
+    def remove(self, ids):
+        with self._lock:
+            for cid in ids:
+                self._remove(cid)
+
+    def _remove(self, cid):
+        document = self._documents.pop(cid, None)
+        if document is None:
+            return
+        self._total_length -= self._lengths.pop(cid)
+        for term in set(tokenize(document.page_content)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(cid, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query, k=4):
+        """Return up to k (Document, score) pairs ranked by BM25"""
+        with self._lock:
+            total = len(self._documents)
+            if not total:
+                return []
+            average_length = self._total_length / total
+            scores = Counter()
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for cid, count in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[cid] / average_length)
+                    scores[cid] += idf * count * (self.k1 + 1) / (count + norm)
+            return [(self._documents[cid], score) for cid, score in scores.most_common(k)]
+
+    def save(self, persist_directory):
+        """Atomically write the indexed chunks next to the vector store"""
+        with self._lock:
+            data = {
+                cid: {"page_content": doc.page_content, "metadata": doc.metadata}
+                for cid, doc in self._documents.items()
+            }
+        os.makedirs(persist_directory, exist_ok=True)
+        path = os.path.join(persist_directory, LEXICAL_INDEX_FILENAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, persist_directory):
+        """Load a saved index, or return an empty one if none exists"""
+        index = cls()
+        path = os.path.join(persist_directory, LEXICAL_INDEX_FILENAME)
+        if not os.path.exists(path):
+            return index
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        index.add(
+            list(data),
+            [Document(page_content=item["page_content"], metadata=item["metadata"]) for item in data.values()]
+        )
+        return index
@@ -0,0 +1,151 @@
+"""Micro-batching of query embeddings and vector searches across sessions
+
+Questions from different sessions that reach the embedding or search step
+within a few milliseconds of each other are sent as one batched embedding
+request and one matrix search, and each caller gets back its own result.
+No caller waits more than the batching window for others to join.
+"""
+
+import asyncio
+from functools import partial
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_WINDOW_SECONDS = 0.005
+DEFAULT_MAX_BATCH_SIZE = 32
+
+
+class MicroBatcher:
+    """Gather items submitted within window seconds into one call of process
+
+    process is a coroutine function taking a list of items and returning
+    their results in the same order. A batch goes out window seconds after
+    its first item, or as soon as it holds max_size items. If process fails,
+    every caller in the batch gets the exception. Pending items and the
+    flush timer belong to one loop, per the threading contract in
+    async_runtime.
+    """
+
+    def __init__(self, process, window=DEFAULT_WINDOW_SECONDS, max_size=DEFAULT_MAX_BATCH_SIZE):
+        self.process = process
+        self.window = window
+        self.max_size = max_size
+        self.batches = 0
+        self.items = 0
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, item):
+        """Add item to the next batch and wait for its result"""
+        if self.window <= 0 or self.max_size <= 1:
+            self.batches += 1
+            self.items += 1
+            return (await self.process([item]))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Callers cancelled while waiting don't need their item processed
+        batch = [(item, future) for item, future in self._pending if not future.done()]
+        self._pending = []
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.process([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch of {len(batch)} items returned {len(results)} results")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
+
+
+class BatchedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper that sends concurrent async query embeddings as one request
+
+    Identical texts in a batch are embedded once. Sync calls and document
+    embeddings pass straight through. Wrap the network client (inside any
+    cache and timing wrappers), so only cache misses are batched and each
+    caller is still timed and charged for its own query.
+    """
+
+    def __init__(self, embeddings, window=DEFAULT_WINDOW_SECONDS, max_size=DEFAULT_MAX_BATCH_SIZE):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.batcher = MicroBatcher(self._embed_batch, window, max_size)
+
+    async def _embed_batch(self, texts):
+        unique = list(dict.fromkeys(texts))
+        vectors = dict(zip(unique, await self.embeddings.aembed_documents(unique)))
+        return [vectors[text] for text in texts]
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text):
+        return await self.batcher.submit(text)
+
+
+class BatchedVectorSearch:
+    """Run concurrent similarity searches against one vector store as a single batched search
+
+    Each batch is searched for the largest k asked for and every caller's
+    results are cut to its own k. The search runs in executor, off the
+    event loop.
+    """
+
+    def __init__(self, vectorstore, executor=None, window=DEFAULT_WINDOW_SECONDS, max_size=DEFAULT_MAX_BATCH_SIZE):
+        self.vectorstore = vectorstore
+        self.executor = executor
+        self.batcher = MicroBatcher(self._search_batch, window, max_size)
+
+    async def _search_batch(self, items):
+        largest_k = max(k for _, k in items)
+        loop = asyncio.get_running_loop()
+        embeddings = [embedding for embedding, _ in items]
+        results = await loop.run_in_executor(
+            self.executor, partial(self.vectorstore.similarity_search_by_vectors, embeddings, largest_k)
+        )
+        return [documents[:k] for documents, (_, k) in zip(results, items)]
+
+    async def search(self, embedding, k):
+        """The k chunks nearest embedding"""
+        return await self.batcher.submit((embedding, k))
+
+    def stats(self):
+        return self.batcher.stats()
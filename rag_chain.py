@@ -0,0 +1,123 @@
+"""Conversational retrieval chain shared by the app and offline tools"""
+
+import re
+
+from langchain.chains import ConversationalRetrievalChain
+from langchain.prompts import PromptTemplate
+
+from micro_batching import DEFAULT_MAX_BATCH_SIZE
+from reranking import DEFAULT_CANDIDATES, DEFAULT_MMR_LAMBDA
+from retrieval import BudgetedRetriever, HybridRetriever, RerankingRetriever, batched_vector_search, section_neighbors
+
+ANSWER_PROMPT_TEMPLATE = """You are an AI Learning Assistant specialized in instructional design, eLearning, and learning theories.
+Use the following context to answer the question. If you don't know the answer based on the context, say so clearly.
+Always provide detailed, educational responses.
+
+Context: {context}
+
+Question: {question}
+
+Answer:"""
+
+# Words that usually point back to an earlier turn
+REFERENCE_WORDS = frozenset("""
+    it its itself they them their theirs themselves this that these those
+    he him his she her hers one ones there former latter above previous
+    earlier before again more else also another other same such example examples
+    elaborate further
+""".split())
+FOLLOW_UP_OPENERS = ("and ", "but ", "so ", "or ", "also ", "then ", "what about", "how about", "why not")
+
+
+def make_answer_prompt():
+    """Prompt used to answer from the retrieved context"""
+    return PromptTemplate(
+        template=ANSWER_PROMPT_TEMPLATE,
+        input_variables=["context", "question"]
+    )
+
+
+def is_standalone_question(question, chat_history):
+    """Guess whether a question can go straight to retrieval without condensing
+
+    Cheap local heuristics: anything that may refer back to the conversation
+    (pronouns, "more", "example", elliptical openers, one- or two-word
+    questions) counts as a follow-up, so a wrong guess only costs the condense
+    call it would have made anyway.
+    """
+    if not chat_history:
+        return True
+    text = question.lower().strip()
+    words = re.findall(r"[a-z]+", text)
+    if len(words) < 3 or text.startswith(FOLLOW_UP_OPENERS):
+        return False
+    return REFERENCE_WORDS.isdisjoint(words)
+
+
+def make_retriever(vectorstore, lexical_index, k=3, mode="hybrid", vector_timeout=5.0, max_tokens=2000,
+                   candidates=DEFAULT_CANDIDATES, mmr_lambda=DEFAULT_MMR_LAMBDA, cross_encoder=None,
+                   chunk_index=None, neighbor_chunks=1, batch_window=0.0, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    """Hybrid retriever whose candidates are re-ranked, de-duplicated and fitted to a token budget
+
+    candidates chunks are fetched, re-ordered by relevance and diversity
+    (see RerankingRetriever), and the first k that aren't near-duplicates and
+    fit max_tokens reach the prompt. candidates=0 turns re-ranking off; it is
+    also skipped in "lexical" mode, which is meant to make no embedding calls.
+    With a chunk_index, up to neighbor_chunks neighbouring parts of each
+    chunk's section fill any budget left over. A batch_window (seconds) above
+    zero batches concurrent async vector searches, up to max_batch_size at a
+    time; the retriever must then only be awaited from one event loop.
+    """
+    search_batcher = None
+    if batch_window > 0 and mode != "lexical":
+        search_batcher = batched_vector_search(vectorstore, batch_window, max_batch_size)
+    if candidates and mode != "lexical":
+        retriever = RerankingRetriever(
+            retriever=HybridRetriever(
+                vectorstore=vectorstore,
+                lexical_index=lexical_index,
+                k=max(candidates, k),
+                fetch_k=max(candidates, k),
+                mode=mode,
+                vector_timeout=vector_timeout,
+                search_batcher=search_batcher
+            ),
+            embeddings=vectorstore.embeddings,
+            vectorstore=vectorstore,
+            cross_encoder=cross_encoder,
+            lambda_mult=mmr_lambda
+        )
+    else:
+        # Over-fetch so chunks dropped as duplicates can be replaced
+        retriever = HybridRetriever(
+            vectorstore=vectorstore,
+            lexical_index=lexical_index,
+            k=k * 2,
+            mode=mode,
+            vector_timeout=vector_timeout,
+            search_batcher=search_batcher
+        )
+    return BudgetedRetriever(
+        retriever=retriever,
+        k=k,
+        max_tokens=max_tokens,
+        neighbors=section_neighbors(chunk_index, lexical_index) if chunk_index is not None else None,
+        neighbor_chunks=neighbor_chunks
+    )
+
+
+def make_conversation_chain(llm, condense_llm, retriever, prompt=None):
+    """Build a memory-less conversational retrieval chain
+
+    Callers pass chat_history with every question, so one chain can be
+    shared by any number of conversations. The chain only condenses when
+    chat_history is non-empty, so pass [] for standalone questions (see
+    is_standalone_question); condense_llm can be a smaller, cheaper model.
+    """
+    return ConversationalRetrievalChain.from_llm(
+        llm=llm,
+        condense_question_llm=condense_llm,
+        retriever=retriever,
+        return_source_documents=True,
+        combine_docs_chain_kwargs={"prompt": prompt or make_answer_prompt()}
+    )
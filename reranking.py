@@ -0,0 +1,65 @@
+"""Re-ranking of retrieved candidates: MMR diversity and an optional local cross-encoder"""
+
+import numpy as np
+
+DEFAULT_CANDIDATES = 20
+DEFAULT_MMR_LAMBDA = 0.5
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _rescale(scores):
+    """Min-max scale scores to [0, 1] so relevance and similarity are comparable"""
+    low, high = scores.min(), scores.max()
+    if high - low < 1e-12:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+def mmr_order(relevance, embeddings, lambda_mult=DEFAULT_MMR_LAMBDA):
+    """Order candidates by maximal marginal relevance; returns candidate indices
+
+    Each pick maximizes lambda_mult * relevance minus (1 - lambda_mult) times
+    the candidate's highest cosine similarity to anything already picked, so
+    near-duplicates of a chosen chunk sink to the end.
+    """
+    relevance = _rescale(np.asarray(relevance, dtype=np.float32))
+    vectors = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    similarity = vectors @ vectors.T
+
+    order = []
+    remaining = list(range(len(relevance)))
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    while remaining:
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy[remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        order.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return order
+
+
+class CrossEncoderReranker:
+    """Score (query, passage) pairs with a small sentence-transformers cross-encoder on CPU"""
+
+    def __init__(self, model_name, max_length=512):
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+    def score(self, query, texts):
+        return [float(score) for score in self.model.predict([(query, text) for text in texts])]
+
+
+def load_cross_encoder(model_name):
+    """Load a cross-encoder, or None if no model is configured or sentence-transformers isn't installed"""
+    if not model_name:
+        return None
+    try:
+        return CrossEncoderReranker(model_name)
+    except ImportError:
+        return None
@@ -0,0 +1,245 @@
+"""Retrievers used by the conversational chain"""
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any
+
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from context_budget import DEFAULT_MODEL, expand_with_neighbors, select_documents
+from indexing import chunk_id
+from micro_batching import BatchedVectorSearch
+from reranking import DEFAULT_MMR_LAMBDA, mmr_order
+
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+# Vector searches run here so a slow embedding endpoint can be timed out
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vector-search")
+
+
+def document_key(document):
+    """Identify a chunk across retrievers, which don't share IDs"""
+    return (document.metadata.get("source"), document.page_content)
+
+
+def reciprocal_rank_fusion(result_lists, k, rrf_k=60):
+    """Fuse ranked document lists with reciprocal rank fusion and keep the top k"""
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, document in enumerate(results):
+            key = document_key(document)
+            documents.setdefault(key, document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ranked[:k]]
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense + BM25 retriever fused with reciprocal rank fusion
+
+    In "hybrid" mode both searches run and are fused; "vector" and "lexical"
+    use one of them. If the vector search fails or takes longer than
+    vector_timeout seconds, lexical results are returned instead. The async
+    path embeds the query with the async client and runs the vector and BM25
+    searches concurrently; with a search_batcher (see
+    micro_batching.BatchedVectorSearch) its vector search is batched with
+    other sessions' searches.
+    """
+
+    vectorstore: Any
+    lexical_index: Any
+    k: int = 3
+    fetch_k: int = 10
+    mode: str = "hybrid"
+    vector_timeout: float = 5.0
+    search_batcher: Any = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _lexical_search(self, query, k):
+        return [document for document, _ in self.lexical_index.search(query, k)]
+
+    def _vector_search(self, query, k):
+        # Carry the caller's context so the search is attributed to its trace
+        context = contextvars.copy_context()
+        future = _search_pool.submit(context.run, self.vectorstore.similarity_search, query, k)
+        return future.result(timeout=self.vector_timeout)
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        if self.mode == "lexical":
+            return self._lexical_search(query, self.k)
+
+        fetch_k = self.k if self.mode == "vector" else self.fetch_k
+        try:
+            vector_results = self._vector_search(query, fetch_k)
+        except Exception:
+            # Embedding endpoint slow or unavailable: answer from BM25 alone
+            if not len(self.lexical_index):
+                raise
+            return self._lexical_search(query, self.k)
+
+        if self.mode == "vector":
+            return vector_results
+        lexical_results = self._lexical_search(query, self.fetch_k)
+        return reciprocal_rank_fusion([vector_results, lexical_results], self.k)
+
+    async def _alexical_search(self, query, k):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_search_pool, self._lexical_search, query, k)
+
+    async def _avector_search(self, query, k):
+        embedding = await self.vectorstore.embeddings.aembed_query(query)
+        if self.search_batcher is not None:
+            return await self.search_batcher.search(embedding, k)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _search_pool, partial(self.vectorstore.similarity_search_by_vector, embedding, k)
+        )
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        if self.mode == "lexical":
+            return await self._alexical_search(query, self.k)
+
+        fetch_k = self.k if self.mode == "vector" else self.fetch_k
+        vector_task = asyncio.ensure_future(
+            asyncio.wait_for(self._avector_search(query, fetch_k), self.vector_timeout)
+        )
+        lexical_results = await self._alexical_search(query, self.fetch_k) if len(self.lexical_index) else []
+        try:
+            vector_results = await vector_task
+        except Exception:
+            # Embedding endpoint slow or unavailable: answer from BM25 alone
+            if not lexical_results:
+                raise
+            return lexical_results[:self.k]
+
+        if self.mode == "vector":
+            return vector_results
+        return reciprocal_rank_fusion([vector_results, lexical_results], self.k)
+
+
+class RerankingRetriever(BaseRetriever):
+    """Re-order a wide candidate pool so the best, least redundant chunks come first
+
+    Relevance comes from the cross_encoder if one is given, otherwise from
+    cosine similarity to the query; maximal marginal relevance then pushes
+    near-duplicates (e.g. overlapping neighbour chunks) to the back. Chunk
+    vectors are read from the vectorstore; only chunks it doesn't hold are
+    embedded, through the same (cached) embeddings used for indexing. If
+    that fails the candidates are returned as they are.
+    """
+
+    retriever: BaseRetriever
+    embeddings: Any
+    vectorstore: Any = None
+    cross_encoder: Any = None
+    lambda_mult: float = DEFAULT_MMR_LAMBDA
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _stored_vectors(self, documents):
+        if self.vectorstore is None:
+            return [None] * len(documents)
+        return self.vectorstore.vectors_for([
+            chunk_id(document.metadata.get("source", "unknown"), document.page_content) for document in documents
+        ])
+
+    def _rerank(self, query, documents, query_embedding, document_embeddings):
+        if self.cross_encoder is not None:
+            relevance = self.cross_encoder.score(query, [document.page_content for document in documents])
+        else:
+            relevance = [float(np.dot(query_embedding, vector)) for vector in document_embeddings]
+        return [documents[i] for i in mmr_order(relevance, document_embeddings, self.lambda_mult)]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        if len(documents) <= 1:
+            return documents
+        try:
+            query_embedding = self.embeddings.embed_query(query)
+            document_embeddings = self._stored_vectors(documents)
+            missing = [i for i, vector in enumerate(document_embeddings) if vector is None]
+            if missing:
+                embedded = self.embeddings.embed_documents([documents[i].page_content for i in missing])
+                for i, vector in zip(missing, embedded):
+                    document_embeddings[i] = vector
+        except Exception:
+            return documents
+        return self._rerank(query, documents, query_embedding, document_embeddings)
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        documents = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        if len(documents) <= 1:
+            return documents
+        loop = asyncio.get_running_loop()
+        try:
+            query_embedding = await self.embeddings.aembed_query(query)
+            document_embeddings = await loop.run_in_executor(_search_pool, self._stored_vectors, documents)
+            missing = [i for i, vector in enumerate(document_embeddings) if vector is None]
+            if missing:
+                embedded = await self.embeddings.aembed_documents([documents[i].page_content for i in missing])
+                for i, vector in zip(missing, embedded):
+                    document_embeddings[i] = vector
+        except Exception:
+            return documents
+        # Cross-encoder scoring is CPU-bound; keep it off the event loop
+        return await loop.run_in_executor(
+            _search_pool, self._rerank, query, documents, query_embedding, document_embeddings
+        )
+
+
+def batched_vector_search(vectorstore, window, max_size):
+    """search_batcher for HybridRetriever: concurrent searches batched and run on the search pool"""
+    return BatchedVectorSearch(vectorstore, _search_pool, window, max_size)
+
+
+def section_neighbors(chunk_index, lexical_index):
+    """neighbors function for BudgetedRetriever: a chunk's section neighbours, read from the lexical index"""
+    def neighbors(document):
+        cid = chunk_id(document.metadata.get("source", "unknown"), document.page_content)
+        return tuple(
+            lexical_index.get(neighbor) if neighbor is not None else None
+            for neighbor in chunk_index.neighbors(cid)
+        )
+    return neighbors
+
+
+class BudgetedRetriever(BaseRetriever):
+    """Wrap a retriever so only non-overlapping chunks within a token budget reach the prompt
+
+    The wrapped retriever should return more candidates than k, so chunks
+    dropped as duplicates can be replaced by the next best ones. If a
+    neighbors function is given (see section_neighbors), up to
+    neighbor_chunks neighbouring parts of each selected chunk's section are
+    added while the budget has room.
+    """
+
+    retriever: BaseRetriever
+    k: int = 3
+    max_tokens: int = 2000
+    model: str = DEFAULT_MODEL
+    neighbors: Any = None
+    neighbor_chunks: int = 1
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _select(self, documents):
+        documents = select_documents(documents, self.max_tokens, k=self.k, model=self.model)
+        if self.neighbors is None or not self.neighbor_chunks:
+            return documents
+        return expand_with_neighbors(documents, self.neighbors, self.max_tokens, self.neighbor_chunks, self.model)
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self._select(documents)
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        documents = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return self._select(documents)
@@ -51,6 +51,19 @@ def test_imports():
         print(f"\n❌ Import error: {e}")
         return False
 
+def test_percentile():
+    """Check nearest-rank percentiles used in the metrics tables"""
+    from instrumentation import percentile
+
+    assert percentile([], 50) == 0.0
+    assert percentile([1, 2], 50) == 1
+    assert percentile(list(range(1, 11)), 50) == 5
+    assert percentile(list(range(1, 21)), 95) == 19
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert percentile(list(range(1, 101)), 100) == 100
+    assert percentile([7], 0) == 7
+    print("✓ percentile")
+
 def check_project_structure():
     """Verify project structure"""
     import os
@@ -59,6 +72,31 @@ def check_project_structure():
 
     files = [
         'learning_assistant.py',
+        'indexing.py',
+        'chunking.py',
+        'build_index.py',
+        'embedding_pipeline.py',
+        'embedding_cache.py',
+        'answer_cache.py',
+        'lexical_index.py',
+        'chunk_metadata.py',
+        'conversation_export.py',
+        'conversation_store.py',
+        'retrieval.py',
+        'reranking.py',
+        'vector_backends.py',
+        'knowledge_bases.py',
+        'hot_reload.py',
+        'context_budget.py',
+        'instrumentation.py',
+        'coalescing.py',
+        'admission.py',
+        'micro_batching.py',
+        'async_runtime.py',
+        'rag_chain.py',
+        'benchmark.py',
+        'benchmark_startup.py',
+        'fake_backends.py',
         'requirements.txt',
         '.env',
         'README.md',
@@ -80,6 +118,7 @@ def check_project_structure():
 
 if __name__ == "__main__":
     imports_ok = test_imports()
+    test_percentile()
     structure_ok = check_project_structure()
 
     if imports_ok and structure_ok:
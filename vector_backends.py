@@ -0,0 +1,528 @@
+"""Vector store backends: Chroma, or an in-process memory-mapped NumPy index
+
+Indexing and retrieval only use the small VectorBackend interface, so the
+backend is picked with one setting. The NumPy backend keeps every vector in a
+single file that is memory-mapped on open (no copy, no client or database
+process), optionally quantized to float16 or int8, and searched by brute
+force or through an IVF (k-means cluster) index.
+"""
+
+import json
+import math
+import os
+import struct
+import threading
+
+import numpy as np
+
+VECTOR_BACKENDS = ("chroma", "numpy")
+QUANTIZATIONS = ("float32", "float16", "int8")
+INDEX_TYPES = ("flat", "ivf")
+VECTOR_INDEX_FILENAME = "vector_index.bin"
+FILE_MAGIC = b"RAGVEC02"
+# IDs and chunk texts in the JSON header
+LEGACY_FILE_MAGIC = b"RAGVEC01"
+ALIGNMENT = 64
+# Below this many vectors an IVF index isn't worth building; search is brute force
+IVF_MIN_VECTORS = 1024
+SEARCH_BLOCK_ROWS = 16384
+
+
+class VectorBackend:
+    """Operations the indexing and retrieval code needs from a vector store"""
+
+    name = None
+    embeddings = None
+    # Whether each upsert is durable on its own, or only after save()
+    durable_writes = True
+
+    def stored_ids(self):
+        """Set of chunk IDs currently stored"""
+        raise NotImplementedError
+
+    def upsert_vectors(self, ids, documents, vectors):
+        """Insert or replace already-computed vectors"""
+        raise NotImplementedError
+
+    def delete(self, ids=None):
+        raise NotImplementedError
+
+    def save(self):
+        """Make every write so far durable"""
+
+    def close(self):
+        """Release the store's memory and handles; the object isn't used afterwards"""
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        raise NotImplementedError
+
+    def vectors_for(self, ids):
+        """Stored vector of each chunk ID, or None where the ID isn't stored"""
+        return [None] * len(ids)
+
+    def similarity_search_by_vectors(self, embeddings, k=4):
+        """One list of the k nearest chunks per embedding"""
+        return [self.similarity_search_by_vector(embedding, k) for embedding in embeddings]
+
+    def similarity_search(self, query, k=4):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+
+class ChromaBackend(VectorBackend):
+    """The persisted Chroma collection; writes are durable as soon as they're made"""
+
+    name = "chroma"
+
+    def __init__(self, embeddings, persist_directory):
+        from langchain_community.vectorstores import Chroma
+
+        self.embeddings = embeddings
+        self.store = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+
+    def stored_ids(self):
+        return set(self.store.get(include=[])["ids"])
+
+    def upsert_vectors(self, ids, documents, vectors):
+        self.store._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=[document.page_content for document in documents],
+            metadatas=[document.metadata for document in documents]
+        )
+
+    def delete(self, ids=None):
+        self.store.delete(ids=list(ids))
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        return self.store.similarity_search_by_vector(embedding, k)
+
+    def vectors_for(self, ids):
+        if not ids:
+            return []
+        result = self.store._collection.get(ids=list(ids), include=["embeddings"])
+        found = dict(zip(result["ids"], result["embeddings"]))
+        return [found.get(cid) for cid in ids]
+
+    def similarity_search_by_vectors(self, embeddings, k=4):
+        # Chroma answers several query embeddings in one call
+        from langchain_core.documents import Document
+
+        results = self.store._collection.query(
+            query_embeddings=list(embeddings), n_results=k, include=["documents", "metadatas"]
+        )
+        return [
+            [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+            for texts, metadatas in zip(results["documents"], results["metadatas"])
+        ]
+
+    def similarity_search(self, query, k=4):
+        return self.store.similarity_search(query, k)
+
+    def close(self):
+        # Chroma keeps one client system per path for the life of the process;
+        # drop it so a closed collection's memory can actually be freed
+        from chromadb.api.client import SharedSystemClient
+
+        system = self.store._client._system
+        identifier = SharedSystemClient._get_identifier_from_settings(system.settings)
+        SharedSystemClient._identifier_to_system.pop(identifier, None)
+        system.stop()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors, quantization):
+    """Encode unit vectors; returns (codes, per-row scales or None)"""
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    if quantization == "int8":
+        # Symmetric per-row scale, so re-quantizing decoded rows is lossless
+        scales = np.abs(vectors).max(axis=1, initial=0.0) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return vectors.astype(np.float32), None
+
+
+def _dot(codes, scales, query):
+    """Cosine scores of query (one vector, or one per column) against encoded rows, a block at a time"""
+    scores = np.empty((len(codes),) + query.shape[1:], dtype=np.float32)
+    for start in range(0, len(codes), SEARCH_BLOCK_ROWS):
+        block = np.asarray(codes[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+        scores[start:start + len(block)] = block @ query
+    if scales is not None:
+        scores *= scales.reshape((-1,) + (1,) * (query.ndim - 1))
+    return scores
+
+
+def _kmeans(vectors, clusters, iterations=10, sample_size=65536):
+    """Spherical k-means centroids for an IVF index"""
+    rng = np.random.default_rng(0)
+    sample = vectors if len(vectors) <= sample_size else vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(clusters):
+            members = sample[assignment == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class _Documents:
+    """Chunk texts and metadata by row, decoded from the index file only when read
+
+    Rows are kept as encoded JSON records; ones written since the file was
+    last saved are held in memory.
+    """
+
+    def __init__(self, blob=None, offsets=None):
+        self._blob = blob
+        self._offsets = offsets
+        self._written = {}
+        self._count = len(offsets) - 1 if offsets is not None else 0
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, row):
+        text, metadata = json.loads(self.encoded(row))
+        return text, metadata
+
+    def encoded(self, row):
+        data = self._written.get(row)
+        if data is None:
+            data = bytes(self._blob[self._offsets[row]:self._offsets[row + 1]])
+        return data
+
+    def set(self, row, text, metadata):
+        self._written[row] = json.dumps([text, metadata]).encode("utf-8")
+        self._count = max(self._count, row + 1)
+
+    def select(self, rows):
+        """A copy holding only the given rows, renumbered from 0"""
+        selected = _Documents()
+        selected._written = {new_row: self.encoded(row) for new_row, row in enumerate(rows)}
+        selected._count = len(selected._written)
+        return selected
+
+
+class NumpyBackend(VectorBackend):
+    """In-process vector index stored in one memory-mapped file
+
+    Vectors are normalized, so scores are cosine similarities. Writes go to
+    in-memory buffers (grown geometrically, so a sync's upserts cost linear
+    time overall) until save() atomically rewrites the file, building the
+    IVF index if enabled, and maps it again. Chunk texts are only decoded
+    from the file for search results. Searches read a snapshot of the arrays
+    and never block on writers.
+    """
+
+    name = "numpy"
+    durable_writes = False
+
+    def __init__(self, embeddings, persist_directory, quantization="float16", index_type="flat", probes=8):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}; expected one of {QUANTIZATIONS}")
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+        self.embeddings = embeddings
+        self.path = os.path.join(persist_directory, VECTOR_INDEX_FILENAME)
+        self.quantization = quantization
+        self.index_type = index_type
+        self.probes = probes
+        self._lock = threading.Lock()
+        self._state = self._empty_state(0)
+        if os.path.exists(self.path):
+            self._state = self._load()
+
+    def _empty_state(self, dim):
+        codes, scales = quantize(np.zeros((0, dim), dtype=np.float32), self.quantization)
+        return {"ids": [], "rows": {}, "documents": _Documents(), "codes": codes, "scales": scales,
+                "buffers": None, "ivf": None}
+
+    def __len__(self):
+        return len(self._state["ids"])
+
+    def close(self):
+        # Dropping the arrays unmaps the file
+        with self._lock:
+            self._state = self._empty_state(0)
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            magic = f.read(len(FILE_MAGIC))
+            if magic not in (FILE_MAGIC, LEGACY_FILE_MAGIC):
+                raise ValueError(f"{self.path} is not a vector index file")
+            (header_length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_length).decode("utf-8"))
+        data_start = _align(len(FILE_MAGIC) + 8 + header_length)
+        count, dim = header["count"], header["dim"]
+
+        def section(name, dtype, shape):
+            if not count or name not in header["sections"]:
+                return np.zeros(shape, dtype=dtype)
+            return np.memmap(self.path, dtype=dtype, mode="r", offset=data_start + header["sections"][name], shape=shape)
+
+        if header["quantization"] != self.quantization:
+            # Stored with another encoding: decode once and re-encode
+            codes = section("codes", header["dtype"], (count, dim))
+            scales = section("scales", np.float32, (count,)) if header["quantization"] == "int8" else None
+            vectors = np.asarray(codes, dtype=np.float32) * (scales[:, None] if scales is not None else 1.0)
+            codes, scales = quantize(_normalize(vectors), self.quantization)
+            ivf = None
+        else:
+            codes = section("codes", header["dtype"], (count, dim))
+            scales = section("scales", np.float32, (count,)) if self.quantization == "int8" else None
+            ivf = None
+            if header.get("ivf") and self.index_type == "ivf":
+                nlist = header["ivf"]["nlist"]
+                ivf = {
+                    "centroids": section("centroids", np.float32, (nlist, dim)),
+                    "offsets": np.asarray(header["ivf"]["offsets"]),
+                }
+
+        if magic == LEGACY_FILE_MAGIC:
+            # Older files keep IDs and chunk texts in the header
+            ids = header["ids"]
+            documents = _Documents()
+            for row, (text, metadata) in enumerate(header["documents"]):
+                documents.set(row, text, metadata)
+        else:
+            sizes = header["sizes"]
+            ids = bytes(section("ids", np.uint8, (sizes["ids"],))).decode("utf-8").split("\n") if count else []
+            documents = _Documents(
+                section("documents", np.uint8, (sizes["documents"],)),
+                section("document_offsets", np.uint64, (count + 1,))
+            )
+        return {
+            "ids": ids,
+            "rows": {cid: i for i, cid in enumerate(ids)},
+            "documents": documents,
+            "codes": codes,
+            "scales": scales,
+            "buffers": None,
+            "ivf": ivf,
+        }
+
+    def stored_ids(self):
+        return set(self._state["ids"])
+
+    def vectors_for(self, ids):
+        # Decoded from the stored codes, so int8 vectors are approximate
+        state = self._state
+        codes, scales = state["codes"], state["scales"]
+        vectors = []
+        for cid in ids:
+            row = state["rows"].get(cid)
+            if row is None or row >= len(codes):
+                vectors.append(None)
+                continue
+            vector = np.asarray(codes[row], dtype=np.float32)
+            vectors.append(vector * scales[row] if scales is not None else vector)
+        return vectors
+
+    def _writable(self, state, count):
+        """Writable code and scale buffers holding state's rows, with room for count rows"""
+        buffers = state["buffers"]
+        if buffers is not None and len(buffers[0]) >= count:
+            return buffers
+        stored = len(state["codes"])
+        capacity = max(count, 2 * stored, 1024)
+        codes = np.empty((capacity, state["codes"].shape[1]), dtype=state["codes"].dtype)
+        codes[:stored] = state["codes"]
+        scales = None
+        if state["scales"] is not None:
+            scales = np.empty(capacity, dtype=np.float32)
+            scales[:stored] = state["scales"]
+        return codes, scales
+
+    def upsert_vectors(self, ids, documents, vectors):
+        if not ids:
+            return
+        new_codes, new_scales = quantize(_normalize(vectors), self.quantization)
+        with self._lock:
+            state = self._state
+            if not len(state["ids"]):
+                state = self._empty_state(new_codes.shape[1])
+            # New rows are appended past the end of every snapshot searches
+            # may hold, so the lists and buffers are extended in place
+            ids_list, rows, stored = state["ids"], state["rows"], state["documents"]
+            targets = []
+            for cid, document in zip(ids, documents):
+                row = rows.get(cid)
+                if row is None:
+                    row = rows[cid] = len(ids_list)
+                    ids_list.append(cid)
+                stored.set(row, document.page_content, document.metadata)
+                targets.append(row)
+            count = len(ids_list)
+            codes, scales = self._writable(state, count)
+            codes[targets] = new_codes
+            if scales is not None:
+                scales[targets] = new_scales
+            # Rows moved, so the IVF lists are stale until the next save()
+            self._state = {"ids": ids_list, "rows": rows, "documents": stored, "codes": codes[:count],
+                           "scales": scales[:count] if scales is not None else None,
+                           "buffers": (codes, scales), "ivf": None}
+
+    def delete(self, ids=None):
+        with self._lock:
+            state = self._state
+            remove = {state["rows"][cid] for cid in ids if cid in state["rows"]}
+            if not remove:
+                return
+            keep = np.array([row not in remove for row in range(len(state["ids"]))], dtype=bool)
+            ids_list = [cid for row, cid in enumerate(state["ids"]) if keep[row]]
+            self._state = {
+                "ids": ids_list,
+                "rows": {cid: i for i, cid in enumerate(ids_list)},
+                "documents": state["documents"].select(np.flatnonzero(keep)),
+                "codes": np.asarray(state["codes"])[keep],
+                "scales": np.asarray(state["scales"])[keep] if state["scales"] is not None else None,
+                "buffers": None,
+                "ivf": None,
+            }
+
+    def save(self):
+        """Atomically rewrite the index file and map it again"""
+        with self._lock:
+            state = self._state
+            codes = np.asarray(state["codes"])
+            scales = np.asarray(state["scales"]) if state["scales"] is not None else None
+            ids = list(state["ids"])
+            count = len(ids)
+            dim = codes.shape[1] if codes.ndim == 2 else 0
+            order = np.arange(count)
+
+            ivf = None
+            if self.index_type == "ivf" and count >= IVF_MIN_VECTORS:
+                vectors = _normalize(np.asarray(codes, dtype=np.float32) * (scales[:, None] if scales is not None else 1.0))
+                centroids = _kmeans(vectors, max(1, int(math.sqrt(count))))
+                assignment = np.argmax(vectors @ centroids.T, axis=1)
+                # Store rows grouped by cluster so each list is one contiguous slice
+                order = np.argsort(assignment, kind="stable")
+                codes = codes[order]
+                scales = scales[order] if scales is not None else None
+                ids = [ids[i] for i in order]
+                offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+                ivf = {"centroids": centroids, "offsets": offsets}
+
+            records = [state["documents"].encoded(row) for row in order]
+            document_offsets = np.zeros(count + 1, dtype=np.uint64)
+            np.cumsum([len(record) for record in records], out=document_offsets[1:])
+            encoded_ids = "\n".join(ids).encode("utf-8")
+
+            arrays = [("codes", codes)]
+            if scales is not None:
+                arrays.append(("scales", scales))
+            if ivf is not None:
+                arrays.append(("centroids", ivf["centroids"].astype(np.float32)))
+            arrays.append(("document_offsets", document_offsets))
+            sections, offset = {}, 0
+            for name, array in arrays:
+                sections[name] = offset
+                offset = _align(offset + array.nbytes)
+            # Variable-length sections go last
+            for name, size in (("ids", len(encoded_ids)), ("documents", int(document_offsets[-1]))):
+                sections[name] = offset
+                offset = _align(offset + size)
+            header = json.dumps({
+                "count": count,
+                "dim": dim,
+                "dtype": codes.dtype.name,
+                "quantization": self.quantization,
+                "sections": sections,
+                "sizes": {"ids": len(encoded_ids), "documents": int(document_offsets[-1])},
+                "ivf": {"nlist": len(ivf["centroids"]), "offsets": ivf["offsets"].tolist()} if ivf else None,
+            }).encode("utf-8")
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            data_start = _align(len(FILE_MAGIC) + 8 + len(header))
+            with open(tmp_path, "wb") as f:
+                f.write(FILE_MAGIC)
+                f.write(struct.pack("<Q", len(header)))
+                f.write(header)
+                for name, array in arrays:
+                    f.seek(data_start + sections[name])
+                    f.write(np.ascontiguousarray(array).tobytes())
+                f.seek(data_start + sections["ids"])
+                f.write(encoded_ids)
+                f.seek(data_start + sections["documents"])
+                for record in records:
+                    f.write(record)
+            os.replace(tmp_path, self.path)
+            self._state = self._load()
+
+    def _candidate_rows(self, state, query):
+        ivf = state["ivf"]
+        if ivf is None:
+            return None
+        probes = min(self.probes, len(ivf["centroids"]))
+        nearest = np.argpartition(-(np.asarray(ivf["centroids"]) @ query), probes - 1)[:probes]
+        offsets = ivf["offsets"]
+        return np.concatenate([np.arange(offsets[c], offsets[c + 1]) for c in nearest])
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        state = self._state
+        if not len(state["ids"]) or k <= 0:
+            return []
+        query = _normalize(embedding)
+        rows = self._candidate_rows(state, query)
+        if rows is None:
+            scores = _dot(state["codes"], state["scales"], query)
+            rows = np.arange(len(scores))
+        else:
+            scales = state["scales"][rows] if state["scales"] is not None else None
+            scores = _dot(state["codes"][rows], scales, query)
+        return _top_documents(state, rows, scores, k)
+
+    def similarity_search_by_vectors(self, embeddings, k=4):
+        state = self._state
+        if not len(embeddings):
+            return []
+        if not len(state["ids"]) or k <= 0:
+            return [[] for _ in embeddings]
+        if state["ivf"] is not None:
+            # Each query probes its own clusters
+            return [self.similarity_search_by_vector(embedding, k) for embedding in embeddings]
+        # Brute force: score every query in one pass over the vectors
+        queries = _normalize(embeddings)
+        scores = _dot(state["codes"], state["scales"], queries.T)
+        rows = np.arange(len(scores))
+        return [_top_documents(state, rows, scores[:, i], k) for i in range(len(queries))]
+
+
+def _top_documents(state, rows, scores, k):
+    """Documents of the k best-scoring rows, best first"""
+    from langchain_core.documents import Document
+
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    results = []
+    for i in top:
+        text, metadata = state["documents"][rows[i]]
+        results.append(Document(page_content=text, metadata=metadata))
+    return results
+
+
+def open_vector_backend(embeddings, persist_directory, backend="chroma", quantization="float16",
+                        index_type="flat", probes=8):
+    """Open (or create) the configured vector backend in persist_directory"""
+    if backend == "chroma":
+        return ChromaBackend(embeddings, persist_directory)
+    if backend == "numpy":
+        return NumpyBackend(embeddings, persist_directory, quantization, index_type, probes)
+    raise ValueError(f"Unknown vector backend {backend!r}; expected one of {VECTOR_BACKENDS}")